@@ -1,19 +1,29 @@
+import json
 import logging
 import math
 import random
+import tempfile
 import textwrap
+import time
 
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from typing import Optional
 
 import jsons
+import numpy
 
 
 STEP = 0.42
+START_CRACK_TRIES = 10000
 
 
 class Crack:
+    # no per-instance __dict__; Substrate.update() walks thousands of these every cycle
+    __slots__ = ('x', 'y', 't', 't_start', 'xs', 'ys', 't_inc', 'curved', 'sand_index', 'sand_p', 'sand_g',
+                 'degrees_drawn', 'cos_t', 'sin_t', 'dx', 'dy', 'cos_inc', 'sin_inc', 'crack_id',
+                 'x_start', 'y_start', 'cycle_start', 'alive')
+
     x: float
     y: float
     t: float
@@ -24,44 +34,174 @@ class Crack:
 
     curved: bool
 
-    sand_color: tuple
+    sand_index: int  # row of Substrate.palette
     sand_p: float
     sand_g: float
 
     degrees_drawn: float
 
+    # direction caches set by start_crack: cos_t and sin_t of t, the straight step (dx, dy), and
+    # for curved cracks the rotation by t_inc that move_draw_crack advances cos_t and sin_t with
+    cos_t: float
+    sin_t: float
+    dx: float
+    dy: float
+    cos_inc: float
+    sin_inc: float
+
     crack_id: int
 
     x_start: float
     y_start: float
     cycle_start: int
 
+    alive: bool  # False once killed, until Substrate drops it from its crack list at the end of the cycle
+
     def __init__(self, crack_id=None):
         self.crack_id = crack_id
+        self.alive = True
 
     def __eq__(self, other):
         return self.crack_id == other.crack_id
 
 
 class Array2D:
-    def __init__(self, n_rows=None, n_cols=None, initial_value=None):
-        self._buf = []
-        for _ in range(n_rows * n_cols):
-            self._buf.append(initial_value)
-        self._n_cols = n_cols
-        self._n_rows = n_rows
+    """
+    2D grid addressed as [x, y], backed by a row-major numpy array.
 
-    def __getitem__(self, *args):
-        row, col = args[0][0], args[0][1]
-        return self._buf[col + row * self._n_cols]
+    The underlying array is available as ``buf`` with shape (height, width)
+    for scalar cells or (height, width, channels) when the initial value is
+    a tuple, so bulk reads, writes and copies can use numpy slicing directly.
+    """
 
-    def __setitem__(self, *args):
-        row, col, value = args[0][0], args[0][1], args[1]
-        self._buf[col + row * self._n_cols] = value
+    def __init__(self, width=None, height=None, initial_value=None, dtype=None, buf=None):
+        if buf is None:
+            shape = (height, width)
+            if isinstance(initial_value, tuple):
+                shape = shape + (len(initial_value),)
+            buf = numpy.full(shape, initial_value, dtype=dtype)
+        self.buf = buf
+        self.height, self.width = buf.shape[:2]
+
+    def __getitem__(self, key):
+        x, y = key
+        return self.buf[y, x]
+
+    def __setitem__(self, key, value):
+        x, y = key
+        self.buf[y, x] = value
+
+    @classmethod
+    def memmap(cls, directory, width, height, initial_value, dtype):
+        """
+        An Array2D backed by an unnamed scratch file in directory instead of RAM.
+
+        Only the pages the simulation touches need to be resident. The file goes away with the array.
+        """
+        shape = (height, width)
+        if isinstance(initial_value, tuple):
+            shape = shape + (len(initial_value),)
+        f = tempfile.TemporaryFile(dir=directory)
+        grid = cls(buf=numpy.memmap(f, dtype=dtype, mode='w+', shape=shape))
+        grid.file = f
+        grid.fill(initial_value)
+        return grid
 
     def fill(self, value):
-        for i in range(self._n_rows * self._n_cols):
-            self._buf[i] = value
+        self.buf[...] = value
+
+    def snapshot(self):
+        return self.buf.copy()
+
+
+class CellIndex:
+    """
+    Append-only list of the grid cells that hold a crack, so a random one can be picked in O(1).
+
+    It also keeps a coarse occupancy map of the grid: blocks[by * blocks_wide + bx] is 1 once any
+    cell of the BLOCK x BLOCK block (bx, by) holds a crack, which lets Substrate.region_color skip
+    empty space. blocks is a bytearray for fast scalar reads, block_map a numpy view of it.
+    """
+    BLOCK_SHIFT = 4
+    BLOCK = 1 << BLOCK_SHIFT
+
+    def __init__(self, width, height, capacity=1024):
+        self.xs = numpy.empty(capacity, dtype=numpy.int32)
+        self.ys = numpy.empty(capacity, dtype=numpy.int32)
+        self.n = 0
+        self.blocks_wide = (width + self.BLOCK - 1) >> self.BLOCK_SHIFT
+        self.blocks = bytearray(self.blocks_wide * ((height + self.BLOCK - 1) >> self.BLOCK_SHIFT))
+        self.block_map = numpy.frombuffer(self.blocks, dtype=numpy.uint8)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        return int(self.xs[i]), int(self.ys[i])
+
+    def _reserve(self, count):
+        if self.n + count > len(self.xs):
+            capacity = max(2 * len(self.xs), self.n + count)
+            self.xs = numpy.resize(self.xs, capacity)
+            self.ys = numpy.resize(self.ys, capacity)
+
+    def add(self, x, y):
+        self._reserve(1)
+        self.xs[self.n] = x
+        self.ys[self.n] = y
+        self.n += 1
+        self.blocks[(y >> self.BLOCK_SHIFT) * self.blocks_wide + (x >> self.BLOCK_SHIFT)] = 1
+
+    def add_many(self, xs, ys):
+        self._reserve(len(xs))
+        self.xs[self.n:self.n + len(xs)] = xs
+        self.ys[self.n:self.n + len(ys)] = ys
+        self.n += len(xs)
+        self.block_map[(numpy.asarray(ys) >> self.BLOCK_SHIFT) * self.blocks_wide
+                       + (numpy.asarray(xs) >> self.BLOCK_SHIFT)] = 1
+
+
+class CrackTracer:
+    """
+    Crack lifecycle events (spawns and deaths), logged at DEBUG to the 'Substrate.cracks' logger in one
+    record per cycle.
+
+    The substrate only traces while that logger is enabled for DEBUG, which it checks once per
+    cycle; otherwise substrate.tracer is None and nothing is recorded. Each record also carries
+    the cycle's events as dicts in its crack_events attribute, for handlers that want them
+    structured.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('Substrate.cracks')
+        self.events = []
+
+    def enabled(self):
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+    def spawn(self, cycle, crack_id, x, y, t, branched):
+        self.events.append({'event': 'spawn', 'cycle': cycle, 'crack_id': crack_id, 'x': x, 'y': y, 't': t,
+                            'branched': branched})
+
+    def death(self, cycle, crack_id, reason, x_start, y_start, x, y, cycle_start):
+        self.events.append({'event': 'death', 'cycle': cycle, 'crack_id': crack_id, 'reason': reason,
+                            'start': (x_start, y_start), 'end': (x, y),
+                            'length': math.hypot(x - x_start, y - y_start), 'lifetime': cycle - cycle_start})
+
+    def flush(self, cycle):
+        if not self.events:
+            return
+        events = self.events
+        self.events = []
+        lines = []
+        for e in events:
+            if e['event'] == 'spawn':
+                lines.append("  spawn crack {crack_id} at ({x:.1f}, {y:.1f}) angle {t:.1f}{how}".format(
+                    how=' branched' if e['branched'] else ' unbranched', **e))
+            else:
+                lines.append("  death crack {crack_id} ({reason}) length {length:.1f} lifetime {lifetime}".format(**e))
+        self.logger.debug("cycle %d: %d crack events\n%s", cycle, len(events), '\n'.join(lines),
+                          extra={'crack_events': events})
 
 
 def hex_to_rgb(value):
@@ -101,6 +241,9 @@ def hex_to_rgb(value):
     return tuple(int(i, 16) for i in textwrap.wrap(value, 2))
 
 
+DEMO_COLORS = ("#c00000", "#00c000", "#0000c0")
+
+
 @dataclass
 class SubstrateParameters:
     height: int = 0
@@ -116,6 +259,7 @@ class SubstrateParameters:
     wireframe: bool = False
     seamless: bool = False
     seed: Optional[tuple[int, tuple[int], Optional[int]]] = None
+    engine: str = 'reference'  # 'reference' (one Crack object at a time) or 'vector' (see vectorEngine.py)
 
     def set_color_list(self, color_list=None):
         parsed_color_list = []
@@ -128,12 +272,36 @@ class SubstrateParameters:
 
         self.parsed_colors = parsed_color_list
 
+    @classmethod
+    def seeded(cls, seed, colors=DEMO_COLORS, **kwargs):
+        """
+        Parameters for a reproducible run: random is seeded with seed and the resulting state kept in .seed.
+        """
+        random.seed(seed)
+        parameters = cls(**kwargs)
+        parameters.set_color_list(colors)
+        parameters.seed = random.getstate()
+        return parameters
+
+    @classmethod
+    def from_json(cls, text):
+        """
+        Load parameters written by jsons.dumps(); jsons cannot turn seed back into random's state tuple by itself.
+        """
+        values = json.loads(text)
+        seed = values.pop('seed', None)
+        parameters = jsons.load(values, cls)
+        if seed is not None:
+            parameters.seed = (seed[0], tuple(seed[1]), seed[2])
+        return parameters
+
 
 class Substrate(ABC):
     next_crack_id: int
     cracks: list  # of cracks
-    c_grid: Array2D  # of ints
+    c_grid: Array2D  # crack angle in degrees of every cell, 10001 where there is none
     off_img: Array2D  # of pixels (RGB)
+    crack_cells: CellIndex  # cells of c_grid that hold a crack
     max_cycles: int
     cycles: int
     initialized: bool
@@ -142,36 +310,62 @@ class Substrate(ABC):
     next_crack_id_when_quiesced: Optional[int]
     logger: logging.Logger
     parameters: SubstrateParameters
-
-    def __init__(self, parameters=None):
+    engine: Optional['VectorEngine']
+    rendering: bool  # False while update_many() has the graphics_* batch hooks suppressed
+    wants_points = True  # False if the backend ignores graphics_draw_points and reads off_img itself
+
+    def __init__(self, parameters=None, c_grid=None, off_img=None, scratch_dir=None, index_existing=False):
+        # c_grid and off_img may be given to draw into existing (e.g. shared) grids;
+        # with scratch_dir they are memory-mapped from files there instead of held in RAM.
+        # index_existing adds the cracks already in a given c_grid to crack_cells, so they are
+        # branched from and seen by _march; leave it off where the grid is shared with other
+        # substrates (tiledSubstrate) whose cracks must stay theirs
         self.parameters = parameters
+        if scratch_dir is not None:
+            c_grid = c_grid or Array2D.memmap(scratch_dir, parameters.width, parameters.height, 10001, numpy.float32)
+            off_img = off_img or Array2D.memmap(scratch_dir, parameters.width, parameters.height,
+                                                parameters.bg_color, numpy.float32)
         self.next_crack_id = 0
         self.cracks = []
-        self.c_grid = Array2D(self.parameters.width, self.parameters.height, 10001)
-        self.off_img = Array2D(self.parameters.width, self.parameters.height, self.parameters.bg_color)
+        self.dead_cracks = 0  # killed cracks still in self.cracks, see kill_crack()
+        self.c_grid = c_grid or Array2D(self.parameters.width, self.parameters.height, 10001, numpy.float32)
+        self.off_img = off_img or Array2D(self.parameters.width, self.parameters.height, self.parameters.bg_color,
+                                          numpy.float32)
+        self.frame_buf = None  # see frame()
+        # parsed_colors as an (n, 3) lookup table, so cracks carry an index into it instead of a color tuple
+        self.palette = numpy.array(self.parameters.parsed_colors, dtype=numpy.float64).reshape(-1, 3)
+        self.crack_cells = CellIndex(self.parameters.width, self.parameters.height)
+        if index_existing and c_grid is not None:
+            ys, xs = numpy.nonzero(self.c_grid.buf <= 10000)
+            self.crack_cells.add_many(xs, ys)
         self.cycles = 0
         self.initialized = False
         self.quiesced = False
         self.was_quiesced = False
         self.next_crack_id_when_quiesced = None
         self.done = False
+        self.restored = False  # set by checkpoint.load() so the first update() brings up the backend
+        self.engine = None
+        self.exporter = None  # a frameExport.FrameExporter to hand each cycle to
+        self.profiler = None  # a profiler.Profiler to record each cycle's timings and counters in
+        self.crack_tracer = CrackTracer()
+        self.tracer = None  # crack_tracer while its logger is enabled, see update()
+        self.pending_points = []
+        self.pending_point = ([], [], [])
+        self.rendering = True
         self.logger = logging.getLogger('Substrate')
 
     def start_crack(self, cr: Crack):
-        self.logger.info("Starting crack %d", cr.crack_id)
-        found = False
-        timeout = 0
-        px = py = 0  # superfluous
-        while not found and timeout < 10000:
-            timeout = timeout + 1
-            px = random.randint(0, self.parameters.width - 1)
-            py = random.randint(0, self.parameters.height - 1)
-
-            if self.c_grid[px, py] < 10000:
-                found = True
-
-        if not found:
-            # we timed out, use default values
+        # The original search tried up to START_CRACK_TRIES random pixels for one holding a crack.
+        # Draw the outcome of that search directly instead: it misses with probability
+        # (1 - crack cells / all cells) ** START_CRACK_TRIES, and otherwise finds a uniformly
+        # random crack cell, which crack_cells gives us in O(1).
+        n_cells = len(self.crack_cells)
+        miss = (1.0 - n_cells / (self.parameters.width * self.parameters.height)) ** START_CRACK_TRIES
+        if n_cells == 0 or random.random() < miss:
+            # nothing found, use default values
+            if self.profiler is not None:
+                self.profiler.count('start_crack_misses')
             px = cr.x
             py = cr.y
 
@@ -185,9 +379,17 @@ class Substrate(ABC):
             if py >= self.parameters.height:
                 py = self.parameters.height - 1
 
+            if self.c_grid[px, py] > 10000:
+                self.crack_cells.add(px, py)
+            # the fractional angle, as the list-backed grid kept it; cracks drawn over the cell
+            # later store whole degrees, and cracks branching from it read it back
             self.c_grid[px, py] = cr.t
-
-        old_a = a = self.c_grid[px, py]
+            a = cr.t
+            branched = False
+        else:
+            px, py = self.crack_cells[random.randrange(n_cells)]
+            a = float(self.c_grid[px, py])
+            branched = True
 
         if random.choice([True, False]):
             a = a - 90 + random.uniform(-2, 2.1)  # (frand(4.1) - 2)
@@ -208,6 +410,8 @@ class Substrate(ABC):
 
             cr.ys = r * math.sin(radian_inc)
             cr.xs = r * (1 - math.cos(radian_inc))
+            cr.cos_inc = math.cos(radian_inc)
+            cr.sin_inc = math.sin(radian_inc)
         else:
             cr.curved = False
 
@@ -215,19 +419,24 @@ class Substrate(ABC):
         cr.y_start = cr.y = py + (0.61 * math.sin(math.radians(a)))
         cr.cycle_start = self.cycles
         cr.t = cr.t_start = a
-        self.logger.debug("starting crack %d, starting from %s (angle %f), my angle %f",
-                          cr.crack_id, (px, py), old_a, a)
+        cr.cos_t = math.cos(a * math.pi/180)
+        cr.sin_t = math.sin(a * math.pi/180)
+        cr.dx = float(STEP) * cr.cos_t
+        cr.dy = float(STEP) * cr.sin_t
+        if self.tracer is not None:
+            self.tracer.spawn(self.cycles, cr.crack_id, cr.x, cr.y, a, branched)
 
     def make_crack(self):
-        if len(self.cracks) < self.parameters.max_num and not self.quiesced:
-            self.logger.debug("creating %d", self.next_crack_id)
+        if self.engine is not None:
+            self.engine.make_cracks(1)
+            return
+        if len(self.cracks) - self.dead_cracks < self.parameters.max_num and not self.quiesced:
             cr = Crack(crack_id=self.next_crack_id)
             self.next_crack_id += 1
-            self.logger.debug("made crack = %d", cr.crack_id)
             self.cracks.append(cr)
             cr.sand_p = 0
             cr.sand_g = random.uniform(-0.01, 0.19)  # (frand(0.2) - 0.01)
-            cr.sand_color = random.choice(self.parameters.parsed_colors)
+            cr.sand_index = random.randrange(len(self.palette))  # draws what random.choice(parsed_colors) did
             cr.curved = False
             cr.degrees_drawn = 0
 
@@ -235,49 +444,66 @@ class Substrate(ABC):
             cr.y = random.randint(0, self.parameters.height - 1)
             cr.t = random.uniform(0, 360)
 
-            self.start_crack(cr)
-        else:
-            self.logger.debug("make_crack: done! next_crack_id %d, quiesced %s", self.next_crack_id, str(self.quiesced))
+            if self.profiler is not None:
+                start = time.perf_counter()
+                self.start_crack(cr)
+                self.profiler.add_time('start_crack', time.perf_counter() - start)
+                self.profiler.count('cracks_spawned')
+            else:
+                self.start_crack(cr)
 
     def trans_point(self, x1, y1, myc, a):
-        x1 = int(x1)
-        y1 = int(y1)
-        if 0 <= x1 < self.parameters.width and 0 <= y1 < self.parameters.height:
-            if a >= 1.0:
-                self.off_img[x1, y1] = myc
-            else:
-                o_r, o_g, o_b = self.off_img[x1, y1]
-                r, g, b = myc
-                n_r = o_r + (r - o_r) * a
-                n_g = o_g + (g - o_g) * a
-                n_b = o_b + (b - o_b) * a
-                c = (n_r, n_g, n_b)
-                self.off_img[x1, y1] = c
-                return c
-        return self.parameters.bg_color
+        xs, ys, colors = self.trans_points(numpy.array([x1]), numpy.array([y1]), myc, numpy.array([a]))
+        return colors[0] if len(colors) else self.parameters.bg_color
+
+    def trans_points(self, xs, ys, myc, alphas):
+        """
+        Batched trans_point: blend myc into off_img at every (xs[i], ys[i]) with alpha alphas[i].
+
+        Points outside the canvas are dropped. Grains landing on the same pixel compose as if they
+        had been blended one after another, (o, a1, a2, ...) -> myc + (o - myc) * (1 - a1) * (1 - a2) ...,
+        so the result matches the sequential per-grain loop up to float rounding: channel values agree
+        to within 1e-3, which can move the truncated 8-bit value of a pixel by at most 1.
+
+        myc may also be an (n, 3) array with one color per point. Overlapping points of different
+        colors are then blended toward their alpha-weighted mean color, which does not depend on the
+        order the points are given in.
+
+        Returns the x and y coordinates of the touched pixels and their new colors, as float32 like
+        off_img, so backends truncating them show the same 8-bit values as image().
+        """
+        if self.profiler is not None:
+            start = time.perf_counter()
+        width = self.parameters.width
+        height = self.parameters.height
+        xs = xs.astype(numpy.intp)  # truncates toward zero, like int()
+        ys = ys.astype(numpy.intp)
+        inside = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+
+        alphas = numpy.minimum(alphas[inside], 1.0)
+        cells, inverse = numpy.unique(ys[inside] * width + xs[inside], return_inverse=True)
+        keep = numpy.ones(len(cells))
+        numpy.multiply.at(keep, inverse, 1.0 - alphas)
+
+        color = numpy.asarray(myc, dtype=numpy.float64)
+        if color.ndim == 2:
+            weight = numpy.zeros(len(cells))
+            numpy.add.at(weight, inverse, alphas)
+            mixed = numpy.zeros((len(cells), 3))
+            numpy.add.at(mixed, inverse, color[inside] * alphas[:, numpy.newaxis])
+            color = mixed / numpy.maximum(weight, 1e-12)[:, numpy.newaxis]
+
+        ys, xs = numpy.divmod(cells, width)
+        colors = (color + (self.off_img.buf[ys, xs] - color) * keep[:, numpy.newaxis]).astype(numpy.float32)
+        self.off_img.buf[ys, xs] = colors
+        if self.profiler is not None:
+            self.profiler.add_time('trans_points', time.perf_counter() - start)
+        return xs, ys, colors
 
     def region_color(self, cr: Crack):
-        rx = float(cr.x)
-        ry = float(cr.y)
-        openspace = True
-
-        while openspace:
-            rx += (0.81 * math.sin(cr.t * math.pi/180))
-            ry -= (0.81 * math.cos(cr.t * math.pi/180))
-
-            cx = int(rx)
-            cy = int(ry)
-            if self.parameters.seamless:
-                cx %= self.parameters.width
-                cy %= self.parameters.height
-
-            if 0 <= cx < self.parameters.width and 0 <= cy < self.parameters.height:
-                if self.c_grid[cx, cy] > 10000:
-                    pass
-                else:
-                    openspace = False
-            else:
-                openspace = False
+        if self.profiler is not None:
+            start = time.perf_counter()
+        rx, ry = self._march(float(cr.x), float(cr.y), 0.81 * cr.sin_t, -0.81 * cr.cos_t)
 
         cr.sand_g += random.uniform(-0.050, 0.050)  # (frand(0.1) - 0.050)
         max_g = 1.0
@@ -292,61 +518,234 @@ class Substrate(ABC):
 
         w = cr.sand_g / (grains - 1)
 
-        for i in range(grains):
-            draw_x = (cr.x + (rx - cr.x) * math.sin(cr.sand_p + math.sin(float(i * w))))
-            draw_y = (cr.y + (ry - cr.y) * math.sin(cr.sand_p + math.sin(float(i * w))))
+        i = numpy.arange(grains)
+        s = numpy.sin(cr.sand_p + numpy.sin(i * w))
+        draw_x = cr.x + (rx - cr.x) * s
+        draw_y = cr.y + (ry - cr.y) * s
 
-            if self.parameters.seamless:
-                draw_x = (draw_x + self.parameters.width) % self.parameters.width
-                draw_y = (draw_y + self.parameters.height) % self.parameters.height
-
-            c = self.trans_point(draw_x, draw_y, cr.sand_color, (0.1 - i / (grains * 10)))
-            self.graphics_draw_point(int(draw_x), int(draw_y), c)
+        if self.parameters.seamless:
+            draw_x = (draw_x + self.parameters.width) % self.parameters.width
+            draw_y = (draw_y + self.parameters.height) % self.parameters.height
+
+        xs, ys, colors = self.trans_points(draw_x, draw_y, self.palette[cr.sand_index], 0.1 - i / (grains * 10))
+        self.draw_points(xs, ys, colors)
+        if self.profiler is not None:
+            self.profiler.add_time('region_color', time.perf_counter() - start)
+
+    def _march(self, rx, ry, step_x, step_y):
+        """
+        Step (rx, ry) by (step_x, step_y) until it lands on a cell holding a crack or leaves the canvas,
+        returning where it stopped.
+
+        Steps through blocks that crack_cells says are empty skip the grid read and bounds test, but
+        still add up one step at a time, so the stopping point is exactly the one a plain march reaches.
+        Relies on every cracked cell of c_grid being in crack_cells.
+        """
+        width = self.parameters.width
+        height = self.parameters.height
+        seamless = self.parameters.seamless
+        blocks = self.crack_cells.blocks
+        blocks_wide = self.crack_cells.blocks_wide
+        shift = CellIndex.BLOCK_SHIFT
+        block = CellIndex.BLOCK
+        # keeps the skipped steps clear of the block's edges despite rounding in the running sums
+        margin = 1e-6
+        while True:
+            rx += step_x
+            ry += step_y
+            raw_x = cx = int(rx)
+            raw_y = cy = int(ry)
+            if seamless:
+                cx %= width
+                cy %= height
+            if not (0 <= cx < width and 0 <= cy < height):
+                return rx, ry
+            if blocks[(cy >> shift) * blocks_wide + (cx >> shift)]:
+                if self.c_grid[cx, cy] <= 10000:
+                    return rx, ry
+                continue
+
+            # Empty block: find how many more steps certainly stay in it. int() keeps a coordinate
+            # in the block's cells [start, end) while it is in [start, end), or [start, end - 1)
+            # once end <= 0, as it truncates negative values toward zero.
+            start_x = raw_x - (cx & (block - 1))
+            end_x = start_x + min(block, width - (cx & ~(block - 1)))
+            start_y = raw_y - (cy & (block - 1))
+            end_y = start_y + min(block, height - (cy & ~(block - 1)))
+            if end_x <= 0:
+                end_x -= 1
+            if end_y <= 0:
+                end_y -= 1
+            steps = 1 << 30
+            if step_x > 0:
+                steps = (end_x - margin - rx) / step_x
+            elif step_x < 0:
+                steps = (rx - start_x - margin) / -step_x
+            if step_y > 0:
+                steps = min(steps, (end_y - margin - ry) / step_y)
+            elif step_y < 0:
+                steps = min(steps, (ry - start_y - margin) / -step_y)
+            for _ in range(int(steps)):
+                rx += step_x
+                ry += step_y
 
     def update(self):
+        self.tracer = self.crack_tracer if self.crack_tracer.enabled() else None
+        profiler = self.profiler
+        if profiler is not None:
+            cycle_start = time.perf_counter()
         if not self.initialized:
             if self.parameters.seed is None:
                 self.parameters.seed = random.getstate()
                 self.logger.info("seed is %s, %s", type(self.parameters.seed), self.parameters.seed)
             else:
                 random.setstate(self.parameters.seed)
+            if self.parameters.engine == 'vector':
+                from vectorEngine import VectorEngine
+                self.engine = VectorEngine(self)
+            elif self.parameters.engine != 'reference':
+                raise ValueError('Unknown engine {}'.format(self.parameters.engine))
             self.off_img.fill(self.parameters.bg_color)
             self.graphics_initialize()
-            self.graphics_batch_start()
-            self.graphics_draw_fill(self.parameters.bg_color)
+            self.begin_batch()
+            if self.rendering:
+                self.graphics_draw_fill(self.parameters.bg_color)
             for _ in range(self.parameters.initial_cracks):
                 self.make_crack()
-            self.graphics_batch_end()
+            self.end_batch()
             self.initialized = True
+            if profiler is not None:
+                profiler.add_time('init', time.perf_counter() - cycle_start)
+        elif self.restored:
+            self.graphics_initialize()
+            self.present()
+            self.restored = False
         if self.quiesced and not self.was_quiesced:
             self.next_crack_id_when_quiesced = self.next_crack_id
             self.was_quiesced = True
+        if profiler is not None:
+            cracks_start = time.perf_counter()
         self.cycles += 1
-        self.graphics_batch_start()
-        for crack in list(self.cracks):
-            self.move_draw_crack(crack)
-        self.graphics_batch_end()
+        self.begin_batch()
+        if self.engine is not None:
+            self.engine.step()
+        else:
+            cracks = self.cracks
+            # cracks started during the cycle are appended past the end of this range and first move next cycle
+            for i in range(len(cracks)):
+                crack = cracks[i]
+                if crack.alive:
+                    self.move_draw_crack(crack)
+            if self.dead_cracks:
+                self._drop_dead_cracks()
+        if profiler is not None:
+            draw_start = time.perf_counter()
+            profiler.add_time('cracks', draw_start - cracks_start)
+        self.end_batch()
+        if profiler is not None:
+            profiler.add_time('draw', time.perf_counter() - draw_start)
         if self.parameters.max_cycles is not None and self.parameters.max_cycles > 0:
             if self.cycles > self.parameters.max_cycles:
                 self.done = True
-        if len(self.cracks) == 0:
+        if self.crack_count() == 0:
             self.done = True
+        if self.exporter is not None:
+            # after done is settled, so the exporter can tell the last cycle
+            self.exporter.capture(self)
+        if self.tracer is not None:
+            self.tracer.flush(self.cycles)
+        if profiler is not None:
+            profiler.end_cycle(self, cycle_start)
+
+    def update_many(self, n=None, present_every=None):
+        """
+        Advance up to n cycles, or until done if n is None, with the graphics_* batch hooks suppressed.
+
+        The whole canvas is presented to the backend once at the end, and also every present_every
+        cycles if given. max_cycles and quiescing end the run as they do for update(); with neither,
+        update_many(None) never returns. Returns the number of cycles run, the time taken and the
+        resulting cycles per second.
+        """
+        first_cycle = self.cycles
+        start = time.perf_counter()
+        self.rendering = False
+        try:
+            while not self.done and (n is None or self.cycles - first_cycle < n):
+                self.update()
+                if present_every and (self.cycles - first_cycle) % present_every == 0:
+                    self.present()
+        finally:
+            self.rendering = True
+        self.present()
+
+        cycles = self.cycles - first_cycle
+        seconds = time.perf_counter() - start
+        cycles_per_second = cycles / seconds if seconds > 0 else 0.0
+        self.logger.info("update_many: %d cycles in %.3fs, %.1f cycles/s", cycles, seconds, cycles_per_second)
+        return {"cycles": cycles, "seconds": seconds, "cycles_per_second": cycles_per_second}
+
+    def run_until_done(self, present_every=None):
+        return self.update_many(None, present_every)
+
+    def present(self):
+        """
+        Redraw the whole canvas from off_img through the backend.
+        """
+        self.pending_points = []
+        self.pending_point = ([], [], [])
+        self.graphics_batch_start()
+        self.graphics_draw_image()
+        self.graphics_batch_end()
+
+    def crack_count(self):
+        if self.engine is not None:
+            return self.engine.n
+        return len(self.cracks) - self.dead_cracks
 
     def crack_list(self):
-        return tuple(cr.crack_id for cr in self.cracks)
+        if self.engine is not None:
+            return tuple(self.engine.crack_id[:self.engine.n].tolist())
+        return tuple(cr.crack_id for cr in self.cracks if cr.alive)
+
+    def status(self):
+        return {
+            "cycles": self.cycles,
+            "next_crack_id_when_quiesced": self.next_crack_id_when_quiesced
+        }
+
+    def image(self):
+        """
+        The canvas as a (height, width, 3) uint8 array, truncating off_img like the backends do.
+        """
+        return self.off_img.buf.astype(numpy.uint8)
+
+    def frame(self, rows=slice(None), columns=slice(None)):
+        """
+        Like image(), optionally limited to a region, but quantized into a uint8 buffer kept between
+        calls rather than a new array. The result is a view of that buffer, good until the next call.
+        """
+        if self.frame_buf is None:
+            self.frame_buf = numpy.empty(self.off_img.buf.shape, dtype=numpy.uint8)
+        frame = self.frame_buf[rows, columns]
+        numpy.copyto(frame, self.off_img.buf[rows, columns], casting='unsafe')
+        return frame
 
     def move_draw_crack(self, cr: Crack):
-        #  self.logger.debug("Crack %d start", cr.crack_id)
-        old = (cr.x, cr.y)
         if not cr.curved:
-            cr.x += float(STEP) * math.cos(cr.t * math.pi/180)
-            cr.y += float(STEP) * math.sin(cr.t * math.pi/180)
+            cr.x += cr.dx
+            cr.y += cr.dy
         else:
-            cr.x += cr.ys * math.cos(cr.t * math.pi/180)
-            cr.y += cr.ys * math.sin(cr.t * math.pi/180)
-            cr.x += cr.xs * math.cos(cr.t * math.pi/180 - math.pi/2)
-            cr.y += cr.xs * math.sin(cr.t * math.pi/180 - math.pi/2)
+            # cos(t - 90) = sin(t), sin(t - 90) = -cos(t)
+            cr.x += cr.ys * cr.cos_t
+            cr.y += cr.ys * cr.sin_t
+            cr.x += cr.xs * cr.sin_t
+            cr.y -= cr.xs * cr.cos_t
             cr.t += cr.t_inc
+            # rotate by t_inc rather than recomputing cos(t) and sin(t); the rounding error this
+            # accumulates stays around 1e-12 over the at most 360 degrees a curved crack lives
+            cos_t = cr.cos_t
+            cr.cos_t = cos_t * cr.cos_inc - cr.sin_t * cr.sin_inc
+            cr.sin_t = cr.sin_t * cr.cos_inc + cos_t * cr.sin_inc
             cr.degrees_drawn += abs(cr.t_inc)
 
         cx = int(cr.x + random.uniform(0.33, 0.66))  # (frand(0.66) - 0.33))
@@ -357,7 +756,7 @@ class Substrate(ABC):
             cx = (cx + self.parameters.width) % self.parameters.width
             cy = (cy + self.parameters.height) % self.parameters.height
 
-        if 0 <= cx < self.parameters.width and 0 <= cy <= self.parameters.height:
+        if 0 <= cx < self.parameters.width and 0 <= cy < self.parameters.height:
             # draw sand painter if we are not wireframe
             if not self.parameters.wireframe:
                 self.region_color(cr)
@@ -371,62 +770,98 @@ class Substrate(ABC):
                 ccccc = (255, 0, 0)
             """
             self.off_img[cx, cy] = ccccc
-            self.graphics_draw_point(cx, cy, ccccc)
+            self.draw_point(cx, cy, ccccc)
 
             if cr.curved and cr.degrees_drawn > 360:
-                self.logger.debug("Crack %d ending, 360 degree curve", cr.crack_id)
                 # completed the circle
                 # REWORK
                 # self.start_crack(cr)
-                self.kill_crack(cr)
-                self.logger.debug("Crack list %s", str(self.crack_list()))
+                self.kill_crack(cr, 'circle')
                 # END REWORK
                 self.make_crack()
                 self.make_crack()
-                self.logger.debug("Crack list %s", str(self.crack_list()))
 
             else:
-                self.logger.debug("Crack %d (%s) was @ %s, now @ %s = %s",
-                                  cr.crack_id, str(cr.t), old, (cx, cy), self.c_grid[cx, cy])
                 if self.c_grid[cx, cy] > 10000 or (abs(self.c_grid[cx, cy] - cr.t) < 5):
                     # continue cracking
+                    if self.c_grid[cx, cy] > 10000:
+                        self.crack_cells.add(cx, cy)
                     self.c_grid[cx, cy] = int(cr.t)
                 elif abs(self.c_grid[cx, cy]) > 2:
-                    self.logger.debug("Crack %d ending, c_grid > 2", cr.crack_id)
                     # REWORK
                     # self.start_crack(cr)
-                    self.kill_crack(cr)
-                    self.logger.debug("Crack list %s", str(self.crack_list()))
+                    self.kill_crack(cr, 'collision')
                     # end REWORK
                     self.make_crack()
                     self.make_crack()
-                    self.logger.debug("Crack list %s", str(self.crack_list()))
-                else:
-                    self.logger.debug("Crack %d was funny", cr.crack_id)
         else:
             # out of bounds
-            self.logger.debug("Crack %d was @ %s, now @ %s, out of bounds", cr.crack_id, old, (cx, cy))
-
             # REWORK
             # cr.x = random.randint(0, self.width-1)
             # cr.y = random.randint(0, self.height-1)
             # cr.t = random.uniform(0, 360.0)
             # self.start_crack(cr)
-            self.kill_crack(cr)
-            self.logger.debug("Crack list %s", str(self.crack_list()))
+            self.kill_crack(cr, 'out of bounds')
             # end REWORK
 
             self.make_crack()
             self.make_crack()
-            self.logger.debug("Crack list %s", str(self.crack_list()))
 
-    def kill_crack(self, cr: Crack = None, reason: dict = None):
-        self.logger.info("Crack %d dying: start=%s, end=%s, length=%f, lifetime=%d", cr.crack_id,
-                         (cr.x_start, cr.y_start), (cr.x, cr.y),
-                         math.sqrt((cr.x_start - cr.x) ** 2 + (cr.y_start - cr.y) ** 2),
-                         self.cycles - cr.cycle_start
-                         )
-        self.cracks.remove(cr)
+    def kill_crack(self, cr: Crack = None, reason: str = None):
+        if self.tracer is not None:
+            self.tracer.death(self.cycles, cr.crack_id, reason, cr.x_start, cr.y_start, cr.x, cr.y, cr.cycle_start)
+        # O(1): leave it in place and drop it, with every other crack killed this cycle, in one pass
+        # at the end of the cycle, which keeps the list in the order the cracks were made
+        cr.alive = False
+        self.dead_cracks += 1
+        if self.profiler is not None:
+            self.profiler.count('cracks_killed')
+
+    def _drop_dead_cracks(self):
+        self.cracks[:] = [cr for cr in self.cracks if cr.alive]
+        self.dead_cracks = 0
+
+    def begin_batch(self):
+        if self.rendering:
+            self.graphics_batch_start()
+
+    def draw_point(self, x, y, color):
+        if self.profiler is not None:
+            self.profiler.count('points_drawn')
+        if self.wants_points and self.rendering:
+            xs, ys, colors = self.pending_point
+            xs.append(x)
+            ys.append(y)
+            colors.append(color)
+
+    def draw_points(self, xs, ys, colors):
+        # colors is an (n, 3) array, or a single color for all n points
+        if self.profiler is not None:
+            self.profiler.count('points_drawn', len(xs))
+        if self.wants_points and self.rendering:
+            self._queue_single_points()
+            self.pending_points.append((xs, ys, colors))
+
+    def _queue_single_points(self):
+        xs, ys, colors = self.pending_point
+        if xs:
+            self.pending_points.append((numpy.array(xs), numpy.array(ys), numpy.array(colors, dtype=numpy.float64)))
+            self.pending_point = ([], [], [])
+
+    def end_batch(self):
+        """
+        Hand every point drawn since the last batch to the backend in one graphics_draw_points call,
+        then end the backend's batch.
+        """
+        if not self.rendering:
+            return
+        self._queue_single_points()
+        if self.pending_points:
+            xs, ys, colors = zip(*self.pending_points)
+            self.pending_points = []
+            colors = [numpy.broadcast_to(c, (len(x), 3)) for x, c in zip(xs, colors)]
+            self.graphics_draw_points(numpy.concatenate(xs), numpy.concatenate(ys), numpy.concatenate(colors))
+        self.graphics_batch_end()
 
     @abstractmethod
     def graphics_batch_start(self):
@@ -440,6 +875,24 @@ class Substrate(ABC):
     def graphics_draw_point(self, x, y, color):
         pass
 
+    def graphics_draw_points(self, xs, ys, colors):
+        """
+        Draw every point of a batch: xs and ys are integer arrays, colors an (n, 3) float array.
+
+        Called once per batch, just before graphics_batch_end, with the points in the order they
+        were drawn. Backends that can blit in bulk should override this; by default each point goes
+        through graphics_draw_point.
+        """
+        for x, y, color in zip(xs, ys, colors):
+            self.graphics_draw_point(int(x), int(y), tuple(color))
+
+    def graphics_draw_image(self):
+        """
+        Draw all of off_img. By default this sends every pixel through graphics_draw_points.
+        """
+        ys, xs = numpy.indices((self.parameters.height, self.parameters.width))
+        self.graphics_draw_points(xs.ravel(), ys.ravel(), self.off_img.buf.reshape(-1, 3))
+
     @abstractmethod
     def graphics_draw_fill(self, color):
         pass
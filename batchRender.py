@@ -0,0 +1,175 @@
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+from Substrate import SubstrateParameters
+import headlessSubstrate
+
+import jsons
+
+
+MANIFEST = 'manifest.jsonl'
+
+
+def job_key(parameters_json):
+    """
+    Name a job after its parameters, so the same job keeps its name across runs of the batch.
+    """
+    canonical = json.dumps(json.loads(parameters_json), sort_keys=True)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def read_jobs(path):
+    """
+    Yield the jobs in a file holding a JSON list of SubstrateParameters, or one per line (JSONL).
+
+    Repeated parameters (say N unseeded copies of one line, for N different images) are separate
+    jobs: the second and later copies get -2, -3, ... appended to their key.
+    """
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        lines = [json.dumps(values) for values in json.loads(text)]
+    else:
+        lines = [line for line in text.splitlines() if line.strip()]
+    seen = {}
+    for line in lines:
+        key = job_key(line)
+        seen[key] = seen.get(key, 0) + 1
+        yield (key if seen[key] == 1 else '{}-{}'.format(key, seen[key])), line
+
+
+def read_manifest(out_dir):
+    """
+    Keys of the jobs a previous run of this batch already finished.
+    """
+    finished = set()
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+                if entry.get('status') == 'ok':
+                    finished.add(entry['key'])
+    except FileNotFoundError:
+        pass
+    return finished
+
+
+def render_job(key, parameters_json, out_dir, timeout=None, quiesce_after=None, compress_level=6,
+               checkpoint_every=None):
+    """
+    Worker process entry point: render one job and write <key>.png and <key>.json into out_dir.
+
+    With checkpoint_every the job checkpoints to <key>.checkpoint.npz as it goes and resumes from
+    there if it was interrupted; the checkpoint is removed once the PNG is written.
+    """
+    parameters = SubstrateParameters.from_json(parameters_json)
+    if parameters.seed is None:
+        # pool workers inherit the parent's random state, don't let them all draw the same image
+        random.seed()
+    start = time.perf_counter()
+    checkpoint_path = os.path.join(out_dir, key + '.checkpoint.npz') if checkpoint_every else None
+    substrate = headlessSubstrate.run(parameters, quiesce_after=quiesce_after, timeout=timeout,
+                                      checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every)
+    seconds = time.perf_counter() - start
+
+    png_path = os.path.join(out_dir, key + '.png')
+    tmp_path = '{}.{}.tmp'.format(png_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(substrate.png_bytes(compress_level=compress_level))
+    os.replace(tmp_path, png_path)
+    with open(os.path.join(out_dir, key + '.json'), 'w') as f:
+        f.write(jsons.dumps({"parameters": parameters, "status": substrate.status(), "seconds": seconds},
+                            verbose=True))
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return {"cycles": substrate.cycles, "seconds": seconds}
+
+
+def render_batch(jobs, out_dir, workers=None, max_in_flight=None, timeout=None, quiesce_after=None,
+                 compress_level=6, checkpoint_every=None):
+    """
+    Render (key, parameters JSON) jobs in a process pool, skipping the ones the manifest in out_dir
+    already records as finished.
+
+    At most max_in_flight jobs (default twice the worker count) are submitted at a time. Every
+    finished or failed job is appended to the manifest as soon as it completes, so a crashed batch
+    can be run again with the same arguments and picks up where it stopped. With checkpoint_every,
+    the jobs that were still running pick up from their last checkpoint too (see render_job).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * workers
+    finished = read_manifest(out_dir)
+    pending = ((key, line) for key, line in jobs if key not in finished)
+    counts = {"ok": 0, "failed": 0, "timeout": 0}
+
+    with open(os.path.join(out_dir, MANIFEST), 'a') as manifest, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < max_in_flight:
+                job = next(pending, None)
+                if job is None:
+                    exhausted = True
+                    break
+                key, line = job
+                future = pool.submit(render_job, key, line, out_dir, timeout, quiesce_after, compress_level,
+                                     checkpoint_every)
+                in_flight[future] = key
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                key = in_flight.pop(future)
+                entry = {"key": key}
+                try:
+                    entry.update(future.result())
+                    # only finished jobs have a PNG to point at
+                    entry.update(status='ok', png=key + '.png')
+                except TimeoutError as e:
+                    entry.update(status='timeout', error=str(e))
+                except Exception as e:
+                    entry.update(status='failed', error=repr(e))
+                counts[entry["status"]] += 1
+                logging.info("job %s: %s", key, entry["status"])
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                os.fsync(manifest.fileno())
+    return counts
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('Substrate').setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Render a batch of substrates headlessly.')
+    parser.add_argument('jobs', help='JSON list or JSONL file of SubstrateParameters')
+    parser.add_argument('out_dir', help='where to write the PNGs, their metadata and the manifest')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='jobs submitted at once')
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per job')
+    parser.add_argument('--quiesce-after', type=int, default=None,
+                        help='stop spawning cracks after this many cycles (for jobs without max_cycles)')
+    parser.add_argument('--compress-level', type=int, default=6, help='PNG compression level, 0-9')
+    parser.add_argument('--checkpoint-every', type=int, default=None,
+                        help='checkpoint running jobs every this many cycles, so they can resume')
+    args = parser.parse_args()
+
+    counts = render_batch(read_jobs(args.jobs), args.out_dir, args.workers, args.max_in_flight,
+                          args.timeout, args.quiesce_after, args.compress_level, args.checkpoint_every)
+    logging.info("batch done: %s", counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+import numpy
+
+from Substrate import SubstrateParameters
+from headlessSubstrate import HeadlessSubstrate
+
+
+SIZES = {
+    '400': (400, 400),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+def cases(sizes=tuple(SIZES), cycles=500, seed=1):
+    """
+    The benchmark matrix: the default parameters at every size, plus max_num, grains, wireframe and
+    seamless variations at the smallest size. Every case has a fixed seed.
+    """
+    base = {'max_num': 100, 'grains': 64, 'wireframe': False, 'seamless': False}
+    variations = [{}, {'max_num': 25}, {'max_num': 400}, {'grains': 16}, {'grains': 128},
+                  {'wireframe': True}, {'seamless': True}]
+    for i, size in enumerate(sizes):
+        for variation in (variations if i == 0 else variations[:1]):
+            case = dict(base, size=size, cycles=cycles, seed=seed, **variation)
+            case['name'] = '{size} max_num={max_num} grains={grains}'.format(**case)
+            case['name'] += ' wireframe' * case['wireframe'] + ' seamless' * case['seamless']
+            yield case
+
+
+class CountingSubstrate(HeadlessSubstrate):
+    """
+    HeadlessSubstrate that counts the points drawn instead of queueing them.
+    """
+    points_drawn = 0
+
+    def draw_point(self, x, y, color):
+        self.points_drawn += 1
+
+    def draw_points(self, xs, ys, colors):
+        self.points_drawn += len(xs)
+
+
+def run_case(case, engine, timeout=None):
+    """
+    Run one case and measure it. Meant to run in a fresh process, so peak memory is the case's own.
+
+    The case runs case['cycles'] cycles, which give cycles/s and pixels/s (points drawn per
+    second), and is then quiesced and run until every crack has died, which gives time to done.
+    """
+    logging.getLogger('Substrate').setLevel(logging.WARNING)
+    width, height = SIZES[case['size']]
+    parameters = SubstrateParameters.seeded(case['seed'], width=width, height=height, max_num=case['max_num'],
+                                            grains=case['grains'], wireframe=case['wireframe'],
+                                            seamless=case['seamless'], engine=engine)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    substrate = CountingSubstrate(parameters=parameters)
+    start = time.perf_counter()
+    while not substrate.done and substrate.cycles < case['cycles']:
+        substrate.update()
+    seconds = time.perf_counter() - start
+    cycles = substrate.cycles
+    points = substrate.points_drawn
+
+    substrate.quiesced = True
+    deadline = None if timeout is None else start + timeout
+    while not substrate.done and (deadline is None or time.perf_counter() < deadline):
+        substrate.update()
+
+    return {
+        'cycles': cycles,
+        'seconds': seconds,
+        'cycles_per_second': cycles / seconds,
+        'pixels_per_second': points / seconds,
+        'time_to_done': time.perf_counter() - start if substrate.done else None,
+        'cycles_to_done': substrate.cycles if substrate.done else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'baseline_rss_mb': baseline_rss / 1024,
+    }
+
+
+def run_benchmark(engines=('reference', 'vector'), sizes=tuple(SIZES), cycles=500, seed=1, timeout=None):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for engine in engines:
+        for case in cases(sizes, cycles, seed):
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                metrics = pool.submit(run_case, case, engine, timeout).result()
+            logging.info("%s %s: %.1f cycles/s, %.0f pixels/s, %s s to done, peak %.0f MB", engine, case['name'],
+                         metrics['cycles_per_second'], metrics['pixels_per_second'],
+                         'n/a' if metrics['time_to_done'] is None else '{:.1f}'.format(metrics['time_to_done']),
+                         metrics['peak_rss_mb'])
+            results.append(dict(case, engine=engine, **metrics))
+    return {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance=0.1):
+    """
+    Compare cycles/s and pixels/s of the cases two benchmark runs share, returning the regressions:
+    (engine, case name, metric, baseline value, current value) where current is more than tolerance slower.
+    """
+    old = {(r['engine'], r['name']): r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        b = old.get((r['engine'], r['name']))
+        if b is None:
+            continue
+        for metric in ('cycles_per_second', 'pixels_per_second'):
+            ratio = r[metric] / b[metric] if b[metric] else 1.0
+            logging.info("%s %s %s: %.1f -> %.1f (%+.1f%%)", r['engine'], r['name'], metric, b[metric], r[metric],
+                         (ratio - 1) * 100)
+            if ratio < 1 - tolerance:
+                regressions.append((r['engine'], r['name'], metric, b[metric], r[metric]))
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Benchmark headless substrates over a fixed matrix of cases.')
+    parser.add_argument('--engine', nargs='+', default=['reference', 'vector'], choices=['reference', 'vector'])
+    parser.add_argument('--sizes', nargs='+', default=list(SIZES), choices=list(SIZES))
+    parser.add_argument('--cycles', type=int, default=500, help='cycles timed per case')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds allowed per case to reach done')
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.engine, args.sizes, args.cycles, args.seed, args.timeout)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for engine, name, metric, before, after in regressions:
+            logging.error("regression: %s %s %s %.1f -> %.1f", engine, name, metric, before, after)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import json
+import os
+import random
+
+import numpy
+
+import jsons
+
+from Substrate import Crack, SubstrateParameters
+
+
+FORMAT_VERSION = 3
+
+# Packed layout of the reference engine's crack list, one row per Crack in list order.
+# Straight cracks never set xs, ys, t_inc, cos_inc and sin_inc; they are stored as 0.
+CRACK_DTYPE = numpy.dtype([
+    ('crack_id', numpy.int64),
+    ('x', numpy.float64), ('y', numpy.float64), ('t', numpy.float64), ('t_start', numpy.float64),
+    ('xs', numpy.float64), ('ys', numpy.float64), ('t_inc', numpy.float64),
+    ('curved', numpy.bool_),
+    ('sand_index', numpy.int32), ('sand_p', numpy.float64), ('sand_g', numpy.float64),
+    ('degrees_drawn', numpy.float64),
+    ('x_start', numpy.float64), ('y_start', numpy.float64), ('cycle_start', numpy.int64),
+    ('cos_t', numpy.float64), ('sin_t', numpy.float64), ('dx', numpy.float64), ('dy', numpy.float64),
+    ('cos_inc', numpy.float64), ('sin_inc', numpy.float64),
+])
+
+SCALARS = ('cycles', 'next_crack_id', 'initialized', 'quiesced', 'was_quiesced', 'next_crack_id_when_quiesced',
+           'done')
+
+
+def save(substrate, path):
+    """
+    Write everything needed to carry on substrate's run to path, a compressed .npz file.
+
+    The file is written next to path and renamed over it, so an interrupted save leaves the
+    previous checkpoint intact. Take checkpoints between update() calls.
+    """
+    state = random.getstate()
+    meta = {
+        'format': FORMAT_VERSION,
+        'parameters': jsons.dumps(substrate.parameters, verbose=True),
+        'random_version': state[0],
+        'random_gauss_next': state[2],
+    }
+    for name in SCALARS:
+        meta[name] = getattr(substrate, name)
+
+    arrays = {
+        'c_grid': substrate.c_grid.buf,
+        'off_img': substrate.off_img.buf,
+        'random_state': numpy.asarray(state[1], dtype=numpy.uint32),
+        'crack_cells_x': substrate.crack_cells.xs[:len(substrate.crack_cells)],
+        'crack_cells_y': substrate.crack_cells.ys[:len(substrate.crack_cells)],
+    }
+
+    engine = substrate.engine
+    if engine is not None:
+        meta['engine_rng'] = engine.rng.bit_generator.state
+        for name in engine.FLOAT_FIELDS + engine.INT_FIELDS + ('curved',):
+            arrays['engine_' + name] = getattr(engine, name)[:engine.n]
+    else:
+        live = [cr for cr in substrate.cracks if cr.alive]
+        cracks = numpy.zeros(len(live), dtype=CRACK_DTYPE)
+        for i, cr in enumerate(live):
+            cracks[i] = tuple(getattr(cr, name, 0) for name in CRACK_DTYPE.names)
+        arrays['cracks'] = cracks
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        numpy.savez_compressed(f, meta=numpy.array(json.dumps(meta)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path, substrate_class, **kwargs):
+    """
+    Rebuild a substrate of substrate_class from a checkpoint written by save(), ready for its next update().
+
+    The global `random` state is restored too, so the resumed run draws exactly the pixels the
+    original run would have. kwargs go to the substrate's constructor (e.g. scratch_dir).
+    """
+    with numpy.load(path, allow_pickle=False) as data:
+        meta = json.loads(data['meta'].item())
+        if meta['format'] != FORMAT_VERSION:
+            raise ValueError('unsupported checkpoint format {}'.format(meta['format']))
+        parameters = SubstrateParameters.from_json(meta['parameters'])
+        substrate = substrate_class(parameters=parameters, **kwargs)
+        substrate.c_grid.buf[...] = data['c_grid']
+        substrate.off_img.buf[...] = data['off_img']
+        substrate.crack_cells.add_many(data['crack_cells_x'], data['crack_cells_y'])
+        for name in SCALARS:
+            setattr(substrate, name, meta[name])
+
+        if 'engine_rng' in meta:
+            from vectorEngine import VectorEngine
+            engine = VectorEngine(substrate)
+            engine.rng.bit_generator.state = meta['engine_rng']
+            n = len(data['engine_x'])
+            if n > engine.capacity:
+                engine._grow(n)
+            for name in engine.FLOAT_FIELDS + engine.INT_FIELDS + ('curved',):
+                getattr(engine, name)[:n] = data['engine_' + name]
+            engine.n = n
+            substrate.engine = engine
+        else:
+            for row in data['cracks']:
+                cr = Crack()
+                for name in CRACK_DTYPE.names:
+                    setattr(cr, name, row[name].item())
+                substrate.cracks.append(cr)
+
+        # after VectorEngine(), which draws its seed from random
+        random.setstate((meta['random_version'], tuple(data['random_state'].tolist()), meta['random_gauss_next']))
+    substrate.restored = substrate.initialized
+    return substrate
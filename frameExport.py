@@ -0,0 +1,237 @@
+import argparse
+import logging
+import os
+import queue
+import struct
+import subprocess
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+import PIL.Image
+import numpy
+
+from Substrate import SubstrateParameters
+from headlessSubstrate import HeadlessSubstrate
+
+
+@dataclass
+class Frame:
+    cycle: int
+    image: numpy.ndarray  # (height, width, 3) uint8
+    # With delta export, the pixels that changed since the previous exported frame, as parallel
+    # xs, ys and (n, 3) colors arrays. None for the first frame, which has nothing to differ from.
+    xs: Optional[numpy.ndarray] = None
+    ys: Optional[numpy.ndarray] = None
+    colors: Optional[numpy.ndarray] = None
+
+    @property
+    def is_delta(self):
+        return self.xs is not None
+
+
+class FrameExporter:
+    """
+    Exports every Nth cycle of a substrate as a frame, without slowing the simulation down.
+
+    Set substrate.exporter to one and update() hands it each cycle. Capturing a frame costs the
+    simulation one uint8 copy of the canvas, which goes into a bounded queue; when the queue is
+    full the frame is dropped and counted in dropped, never waited for. The last cycle of a run
+    is always exported: when the queue is full it takes the place of the oldest queued frame. Everything else happens
+    on the consuming side: either a thread started by start() that passes the frames to sinks
+    (objects with write(frame) and close()), or a frames() generator iterated on another thread.
+    """
+
+    def __init__(self, every=1, sinks=(), delta=False, queue_size=8):
+        self.every = every
+        self.sinks = list(sinks)
+        self.delta = delta
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.captured = 0
+        self.dropped = 0
+        self.thread = None
+        self.logger = logging.getLogger('FrameExporter')
+
+    def capture(self, substrate):
+        if substrate.done:
+            self._put_evicting((substrate.cycles, substrate.image()))
+            self.captured += 1
+            return
+        if substrate.cycles % self.every != 0:
+            return
+        if self.queue.full():
+            # skip the copy too when the consumer is behind
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait((substrate.cycles, substrate.image()))
+            self.captured += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _put_evicting(self, item):
+        # put item without blocking, dropping queued frames to make room
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    self.captured -= 1
+                except queue.Empty:
+                    pass
+
+    def frames(self):
+        """
+        Yield the captured frames until close() is called.
+        """
+        previous = None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            cycle, image = item
+            frame = Frame(cycle, image)
+            if self.delta and previous is not None:
+                ys, xs = numpy.nonzero((image != previous).any(axis=2))
+                frame.xs, frame.ys, frame.colors = xs, ys, image[ys, xs]
+            previous = image
+            yield frame
+
+    def start(self):
+        self.thread = threading.Thread(target=self._write_frames, name='FrameExporter', daemon=True)
+        self.thread.start()
+        return self
+
+    def _write_frames(self):
+        for frame in self.frames():
+            for sink in self.sinks:
+                sink.write(frame)
+
+    def close(self):
+        """
+        Finish writing the frames already captured, then close the sinks.
+
+        Without start(), frames still queued when close() finds the queue full are dropped, since
+        there may be no one left iterating frames() to take them.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        else:
+            self._put_evicting(None)
+        for sink in self.sinks:
+            sink.close()
+        self.logger.info("exported %d frames, dropped %d", self.captured, self.dropped)
+
+
+class ImageSequenceWriter:
+    """
+    Writes each frame as <directory>/frame_<cycle>.png.
+    """
+
+    def __init__(self, directory, compress_level=1):
+        self.directory = directory
+        self.compress_level = compress_level
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        path = os.path.join(self.directory, 'frame_{:08d}.png'.format(frame.cycle))
+        PIL.Image.fromarray(frame.image, 'RGB').save(path, compress_level=self.compress_level)
+
+    def close(self):
+        pass
+
+
+class RawVideoWriter:
+    """
+    Writes each frame's pixels to f as raw rgb24, the stream ffmpeg reads with
+    -f rawvideo -pix_fmt rgb24 -s <width>x<height>. f can be a file, a pipe, or sys.stdout.buffer.
+    """
+
+    def __init__(self, f, process=None):
+        self.f = f
+        self.process = process
+
+    @classmethod
+    def ffmpeg(cls, path, width, height, fps=30, ffmpeg='ffmpeg'):
+        """
+        Pipe the frames into an ffmpeg process encoding them to path.
+        """
+        process = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error',
+                                    '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(width, height),
+                                    '-r', str(fps), '-i', '-', '-pix_fmt', 'yuv420p', path],
+                                   stdin=subprocess.PIPE)
+        return cls(process.stdin, process)
+
+    def write(self, frame):
+        self.f.write(frame.image.tobytes())
+
+    def close(self):
+        self.f.flush()
+        if self.process is not None:
+            self.f.close()
+            self.process.wait()
+
+
+class DeltaWriter:
+    """
+    Writes frames to the binary file f, as deltas where the exporter made them (FrameExporter(delta=True)).
+
+    The stream starts with b'SUBD' and the width and height as two little-endian uint32s. Each
+    frame then has a header of kind (uint8, 0 = full, 1 = delta), cycle (uint32) and count
+    (uint32). A full frame is followed by height * width * 3 bytes of rgb24, a delta frame by count
+    uint32 x's, count uint32 y's and count * 3 bytes of rgb24 for those pixels.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.header_written = False
+
+    def write(self, frame):
+        if not self.header_written:
+            height, width = frame.image.shape[:2]
+            self.f.write(b'SUBD' + struct.pack('<II', width, height))
+            self.header_written = True
+        if frame.is_delta:
+            self.f.write(struct.pack('<BII', 1, frame.cycle, len(frame.xs)))
+            self.f.write(frame.xs.astype('<u4').tobytes())
+            self.f.write(frame.ys.astype('<u4').tobytes())
+            self.f.write(frame.colors.tobytes())
+        else:
+            self.f.write(struct.pack('<BII', 0, frame.cycle, frame.image.shape[0] * frame.image.shape[1]))
+            self.f.write(frame.image.tobytes())
+
+    def close(self):
+        self.f.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('Substrate').setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Render a substrate time-lapse.')
+    parser.add_argument('out', help='directory for a PNG sequence, or a video file with --ffmpeg')
+    parser.add_argument('--every', type=int, default=10, help='export every this many cycles')
+    parser.add_argument('--cycles', type=int, default=3000)
+    parser.add_argument('--ffmpeg', action='store_true', help='encode a video with ffmpeg')
+    args = parser.parse_args()
+
+    substrate_parameters = SubstrateParameters.seeded(1, height=600, width=800, max_num=200, max_cycles=args.cycles,
+                                                      engine='vector')
+
+    if args.ffmpeg:
+        sink = RawVideoWriter.ffmpeg(args.out, substrate_parameters.width, substrate_parameters.height)
+    else:
+        sink = ImageSequenceWriter(args.out)
+    exporter = FrameExporter(every=args.every, sinks=[sink]).start()
+    substrate = HeadlessSubstrate(parameters=substrate_parameters)
+    substrate.exporter = exporter
+    substrate.run_until_done()
+    exporter.close()
+
+
+if __name__ == '__main__':
+    main()
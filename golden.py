@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import PIL.Image
+import numpy
+
+from Substrate import SubstrateParameters
+from headlessSubstrate import HeadlessSubstrate
+
+
+CYCLES = 300
+SEEDS = (1, 2, 3)
+VARIATIONS = {
+    'default': {},
+    'curved': {'circle_percent': 100},
+    'grains16': {'grains': 16},
+    'wireframe': {'wireframe': True},
+    'seamless': {'seamless': True},
+}
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+
+def cases():
+    for seed in SEEDS:
+        for variation, overrides in VARIATIONS.items():
+            yield '{}-seed{}'.format(variation, seed), seed, overrides
+
+
+def digest(substrate):
+    """
+    Content hash of the canvas as the backends show it, and of the crack grid behind it.
+    """
+    h = hashlib.sha1(substrate.frame().tobytes())
+    h.update(substrate.c_grid.buf.tobytes())
+    return h.hexdigest()[:16]
+
+
+def render(engine, seed, overrides, cycles=CYCLES):
+    """
+    Run one case, returning the final image and the digest after every cycle.
+    """
+    parameters = SubstrateParameters.seeded(seed, width=240, height=180, max_num=60, max_cycles=cycles,
+                                            engine=engine, **overrides)
+    substrate = HeadlessSubstrate(parameters=parameters)
+    digests = []
+    while not substrate.done:
+        substrate.update()
+        digests.append(digest(substrate))
+    return substrate.image(), digests
+
+
+def first_divergent_cycle(digests, other):
+    for cycle, (a, b) in enumerate(zip(digests, other), start=1):
+        if a != b:
+            return cycle
+    if len(digests) != len(other):
+        return min(len(digests), len(other)) + 1
+    return None
+
+
+def compare(image, digests, other_image, other_digests):
+    """
+    How far a render is from another: pixels that differ, the largest and mean channel error, and the
+    first cycle whose digest differs (None if every cycle matches).
+    """
+    error = numpy.abs(image.astype(numpy.int16) - other_image.astype(numpy.int16))
+    return {
+        'identical': digests == other_digests,
+        'first_divergent_cycle': first_divergent_cycle(digests, other_digests),
+        'pixels_differing': int(error.any(axis=2).sum()),
+        'max_channel_error': int(error.max()),
+        'mean_channel_error': float(error.mean()),
+    }
+
+
+def record(golden_dir, engines):
+    """
+    Store every case's image as <engine>/<case>.png in golden_dir, and its per-cycle digests in <engine>.json.
+    """
+    for engine in engines:
+        os.makedirs(os.path.join(golden_dir, engine), exist_ok=True)
+        goldens = {}
+        for name, seed, overrides in cases():
+            image, digests = render(engine, seed, overrides)
+            PIL.Image.fromarray(image, 'RGB').save(os.path.join(golden_dir, engine, name + '.png'))
+            goldens[name] = {'seed': seed, 'overrides': overrides, 'hash': digests[-1], 'digests': digests}
+            logging.info("recorded %s %s %s", engine, name, digests[-1])
+        with open(os.path.join(golden_dir, engine + '.json'), 'w') as f:
+            json.dump(goldens, f, indent=1)
+
+
+def load_golden(golden_dir, engine, name):
+    try:
+        with open(os.path.join(golden_dir, engine + '.json')) as f:
+            golden = json.load(f)[name]
+    except (FileNotFoundError, KeyError):
+        return None, None
+    image = numpy.asarray(PIL.Image.open(os.path.join(golden_dir, engine, name + '.png')).convert('RGB'))
+    return image, golden['digests']
+
+
+def check(golden_dir, engines):
+    """
+    Render every case with every engine and compare it with the engine's own golden. Engines other
+    than the reference are also compared with the reference engine as it renders now, which is
+    logged but is not a failure: they draw the same kind of image, not the same pixels.
+
+    Returns the failures as (engine, case, result) with result None where no golden is recorded.
+    """
+    failures = []
+    for name, seed, overrides in cases():
+        reference = render('reference', seed, overrides)
+        for engine in engines:
+            image, digests = reference if engine == 'reference' else render(engine, seed, overrides)
+
+            golden_image, golden_digests = load_golden(golden_dir, engine, name)
+            if golden_image is None:
+                failures.append((engine, name, None))
+            else:
+                result = compare(image, digests, golden_image, golden_digests)
+                logging.info("%s %s vs golden: %s", engine, name, result)
+                if not result['identical']:
+                    failures.append((engine, name, result))
+
+            if engine != 'reference':
+                logging.info("%s %s vs reference: %s", engine, name, compare(image, digests, *reference))
+    return failures
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('Substrate').setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description='Check engines against golden images and the reference engine.')
+    parser.add_argument('--dir', default=GOLDEN_DIR, help='where the golden images and digests live')
+    parser.add_argument('--engine', nargs='+', default=['reference', 'vector'], choices=['reference', 'vector'])
+    parser.add_argument('--record', action='store_true', help='record new goldens instead of checking')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.dir, args.engine)
+        return
+    failures = check(args.dir, args.engine)
+    for engine, name, result in failures:
+        if result is None:
+            logging.error("%s %s has no golden in %s, record one with --record", engine, name, args.dir)
+        else:
+            logging.error("%s %s differs from its golden from cycle %s: %d pixels, max channel error %d", engine,
+                          name, result['first_divergent_cycle'], result['pixels_differing'],
+                          result['max_channel_error'])
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
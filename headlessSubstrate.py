@@ -0,0 +1,133 @@
+import io
+import logging
+import os
+import time
+
+import PIL.Image
+import PIL.PngImagePlugin
+
+from Substrate import Substrate, SubstrateParameters
+import checkpoint
+import pngStream
+
+import jsons
+
+
+# Cycles per second the headless backend is expected to sustain on the benchmark() workload
+# (400x400, max_num=100, 1000 cycles) with each engine; main() reports against these.
+TARGET_CYCLES_PER_SECOND = {
+    'reference': 100,
+    'vector': 1000,
+}
+
+
+class HeadlessSubstrate(Substrate):
+    """
+    Display-less backend: off_img is the only frame buffer, so every graphics_* hook is a no-op.
+    """
+    wants_points = False
+
+    def graphics_batch_start(self):
+        pass
+
+    def graphics_batch_end(self):
+        pass
+
+    def graphics_draw_fill(self, color):
+        pass
+
+    def graphics_draw_point(self, x, y, color):
+        pass
+
+    def graphics_draw_points(self, xs, ys, colors):
+        pass
+
+    def graphics_draw_image(self):
+        pass
+
+    def graphics_initialize(self):
+        logging.info("initialize headless %s %s", self.parameters.width, self.parameters.height)
+
+    def png_text(self):
+        return {
+            "substrate_parameters": jsons.dumps(self.parameters, verbose=True),
+            "substrate_status": jsons.dumps(self.status()),
+        }
+
+    def png_bytes(self, compress_level=6):
+        pnginfo = PIL.PngImagePlugin.PngInfo()
+        for key, value in self.png_text().items():
+            pnginfo.add_text(key, value)
+
+        f = io.BytesIO()
+        PIL.Image.fromarray(self.image(), 'RGB').save(f, format='PNG', pnginfo=pnginfo,
+                                                     compress_level=compress_level)
+        return f.getvalue()
+
+    def save_png(self, path, compress_level=6):
+        """
+        Encode off_img to path a band at a time, without the full-size copies png_bytes() makes.
+        Use this for memory-mapped (scratch_dir) canvases.
+        """
+        with open(path, 'wb') as f:
+            pngStream.write_png(f, self.off_img.buf, self.png_text(), compress_level)
+
+
+def run(substrate_parameters=None, quiesce_after=None, timeout=None, scratch_dir=None,
+        checkpoint_path=None, checkpoint_every=None):
+    """
+    Run a substrate to completion and return it.
+
+    The run ends at substrate_parameters.max_cycles, or after quiesce_after cycles have been drawn
+    and every crack has died. At least one of the two must be set, or the run would never end.
+    If it is still running after timeout seconds, TimeoutError is raised. With scratch_dir the canvas
+    is memory-mapped from files in that directory (see Substrate).
+
+    If checkpoint_path names an existing checkpoint the run resumes from it instead of starting
+    over, and with checkpoint_every a checkpoint is written there every that many cycles.
+    """
+    if not substrate_parameters.max_cycles and quiesce_after is None:
+        raise ValueError('headless run needs max_cycles or quiesce_after')
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        substrate = checkpoint.load(checkpoint_path, HeadlessSubstrate, scratch_dir=scratch_dir)
+        logging.info("resuming %s at cycle %d", checkpoint_path, substrate.cycles)
+    else:
+        substrate = HeadlessSubstrate(parameters=substrate_parameters, scratch_dir=scratch_dir)
+    while not substrate.done:
+        if quiesce_after is not None and substrate.cycles >= quiesce_after:
+            substrate.quiesced = True
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError('headless run still going after {} cycles'.format(substrate.cycles))
+        substrate.update()
+        if checkpoint_every and checkpoint_path is not None and substrate.cycles % checkpoint_every == 0:
+            checkpoint.save(substrate, checkpoint_path)
+    return substrate
+
+
+def render(substrate_parameters=None, quiesce_after=None):
+    return run(substrate_parameters, quiesce_after).image()
+
+
+def benchmark(engine='reference', cycles=1000, seed=1):
+    substrate_parameters = SubstrateParameters.seeded(seed, height=400, width=400, max_num=100, max_cycles=cycles,
+                                                      engine=engine)
+
+    start = time.perf_counter()
+    substrate = run(substrate_parameters)
+    elapsed = time.perf_counter() - start
+    return substrate.cycles / elapsed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger('Substrate').setLevel(logging.WARNING)
+
+    for engine, target in TARGET_CYCLES_PER_SECOND.items():
+        cycles_per_second = benchmark(engine)
+        logging.info("%s engine: %.1f cycles/s (target %d) %s", engine, cycles_per_second, target,
+                     "ok" if cycles_per_second >= target else "BELOW TARGET")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import struct
+import zlib
+
+import numpy
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def _chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+
+def write_png(f, image, text=None, compress_level=6, band_rows=256):
+    """
+    Write a (height, width, 3) array to the binary file f as an 8-bit RGB PNG, band_rows rows at a time.
+
+    Only one band is ever converted to uint8 and held in memory, so image can be a numpy.memmap
+    much larger than RAM. Values are truncated like astype(numpy.uint8). text is a dict of tEXt
+    chunks, as PIL's PngInfo.add_text would write them.
+    """
+    height, width = image.shape[:2]
+    f.write(PNG_SIGNATURE)
+    # 8 bits per channel, color type 2 (RGB), deflate, adaptive filtering, no interlace
+    _chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    for key, value in (text or {}).items():
+        _chunk(f, b'tEXt', key.encode('latin-1') + b'\0' + value.encode('latin-1'))
+
+    compressor = zlib.compressobj(compress_level)
+    for y in range(0, height, band_rows):
+        band = image[y:y + band_rows].astype(numpy.uint8).reshape(-1, width * 3)
+        rows = numpy.empty((len(band), 1 + width * 3), dtype=numpy.uint8)
+        # filter type 1 (Sub): each byte minus the same channel of the pixel to its left
+        rows[:, 0] = 1
+        rows[:, 1:4] = band[:, :3]
+        numpy.subtract(band[:, 3:], band[:, :-3], out=rows[:, 4:])
+        data = compressor.compress(rows.tobytes())
+        if data:
+            _chunk(f, b'IDAT', data)
+    _chunk(f, b'IDAT', compressor.flush())
+    _chunk(f, b'IEND', b'')
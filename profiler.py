@@ -0,0 +1,89 @@
+import collections
+import csv
+import json
+import logging
+import time
+
+
+class Profiler:
+    """
+    Per-cycle timings and counters for a substrate, enabled by setting substrate.profiler to one.
+
+    Timings are seconds per phase, inclusive of the phases nested in them: 'total' is the whole
+    update(), 'cracks' is stepping every crack and contains 'region_color' (which contains
+    'trans_points') and 'start_crack'. 'draw' is handing the cycle's points to the backend.
+    'init' is only non-zero in the first cycle, whose update() also clears the canvas and spawns
+    the initial cracks: their 'start_crack' time and counters land in that cycle too, inside
+    'init' rather than 'cracks'. Attach the profiler before the first update() to record it.
+
+    The last window cycles are kept for summary(). With trace_path every cycle is also written
+    there, as CSV if the path ends in .csv and as JSON lines otherwise. With log_every the
+    summary is logged every that many cycles.
+    """
+
+    PHASES = ('total', 'init', 'cracks', 'region_color', 'trans_points', 'start_crack', 'draw')
+    COUNTERS = ('points_drawn', 'cracks_spawned', 'cracks_killed', 'start_crack_misses', 'live_cracks')
+
+    def __init__(self, window=100, trace_path=None, log_every=None):
+        self.history = collections.deque(maxlen=window)
+        self.log_every = log_every
+        self.logger = logging.getLogger('Profiler')
+        self.current = self._empty()
+        self.trace = None
+        self.writer = None
+        if trace_path is not None:
+            self.trace = open(trace_path, 'w', newline='')
+            if trace_path.endswith('.csv'):
+                self.writer = csv.DictWriter(self.trace, fieldnames=('cycle',) + self.PHASES + self.COUNTERS)
+                self.writer.writeheader()
+
+    def _empty(self):
+        record = dict.fromkeys(self.PHASES, 0.0)
+        record.update(dict.fromkeys(self.COUNTERS, 0))
+        return record
+
+    def add_time(self, phase, seconds):
+        self.current[phase] += seconds
+
+    def count(self, counter, n=1):
+        self.current[counter] += n
+
+    def end_cycle(self, substrate, cycle_start):
+        record = self.current
+        self.current = self._empty()
+        record['total'] = time.perf_counter() - cycle_start
+        record['live_cracks'] = substrate.crack_count()
+        self.history.append(record)
+        if self.trace is not None:
+            row = dict(record, cycle=substrate.cycles)
+            if self.writer is not None:
+                self.writer.writerow(row)
+            else:
+                self.trace.write(json.dumps(row) + '\n')
+        if self.log_every and substrate.cycles % self.log_every == 0:
+            self.logger.info("cycle %d: %s", substrate.cycles, self.format_summary())
+
+    def summary(self):
+        """
+        Mean seconds per cycle of every phase and mean count per cycle of every counter over the window,
+        plus the cycles per second that makes.
+        """
+        n = len(self.history)
+        if n == 0:
+            return {}
+        result = {name: sum(record[name] for record in self.history) / n for name in self.PHASES + self.COUNTERS}
+        result['cycles_per_second'] = 1.0 / result['total'] if result['total'] > 0 else 0.0
+        return result
+
+    def format_summary(self):
+        summary = self.summary()
+        if not summary:
+            return 'no cycles'
+        phases = ' '.join('{}={:.3f}ms'.format(name, summary[name] * 1000) for name in self.PHASES)
+        counters = ' '.join('{}={:.1f}'.format(name, summary[name]) for name in self.COUNTERS)
+        return '{:.1f} cycles/s {} {}'.format(summary['cycles_per_second'], phases, counters)
+
+    def close(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
@@ -1,18 +1,24 @@
 import logging
+import queue
+import threading
 
-from datetime import datetime
-
-import PIL.Image
-import PIL.PngImagePlugin
+import numpy
 import pygame
 import pygame_gui
 
 from Substrate import Substrate
-
-import jsons
+from headlessSubstrate import HeadlessSubstrate
+import saveWorker
 
 
 class PygameSubstrate(Substrate):
+    """
+    Writes each batch's points into the surface in bulk through pygame.surfarray, as colors packed
+    into the surface's own 32-bit pixel format, and pushes only the DIRTY_TILE-sized tiles that
+    were touched to the display.
+    """
+    DIRTY_TILE = 32
+
     surface: pygame.Surface
     window_surface: pygame.Surface
     form_surface: pygame.Surface
@@ -23,59 +29,144 @@ class PygameSubstrate(Substrate):
         logging.info("__init__ %s", self)
         super().__init__(**kwargs)
         self.show_form = False
+        self.form_shown = False  # show_form as of the last graphics_batch_end
+        self.dirty_rects = []
 
     def graphics_batch_start(self):
         pass
 
     def graphics_batch_end(self):
         # logging.debug("updating pygame")
-        pygame.display.update()
+        if self.form_shown and not self.show_form:
+            # the form's overlay covers the whole window, not just the dirty tiles
+            self.dirty_rects = [self.surface.get_rect()]
+        self.form_shown = self.show_form
+        if self.show_form:
+            self.window_surface.blit(self.surface, (0, 0))
+            self.manager.draw_ui(self.form_surface)
+            self.window_surface.blit(self.form_surface, (0, 0))
+            pygame.display.update()
+        elif self.dirty_rects:
+            for rect in self.dirty_rects:
+                self.window_surface.blit(self.surface, rect, rect)
+            pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
 
     def graphics_draw_fill(self, color):
         logging.info("draw_fill %s", color)
         self.surface.fill(color)
+        self.dirty_rects = [self.surface.get_rect()]
+
+    def graphics_draw_image(self):
+        pygame.surfarray.blit_array(self.surface, self.frame().transpose(1, 0, 2))
+        self.dirty_rects = [self.surface.get_rect()]
 
     def graphics_draw_point(self, x, y, color):
         # logging.info("draw_point %d,%d %s", x, y, color)
         self.surface.set_at((x, y), color)
+        self.dirty_rects.append(pygame.Rect(x, y, 1, 1))
+
+    def graphics_draw_points(self, xs, ys, colors):
+        pixels = pygame.surfarray.pixels2d(self.surface)
+        pixels[xs, ys] = self.pack(colors)
+        del pixels  # unlocks the surface
+
+        # merge the touched tiles of each tile row into horizontal runs
+        tile = self.DIRTY_TILE
+        n_cols = (self.parameters.width + tile - 1) // tile
+        tiles = numpy.unique((ys // tile) * n_cols + xs // tile)
+        rows, cols = numpy.divmod(tiles, n_cols)
+        breaks = (numpy.diff(tiles, prepend=-2) != 1) | (numpy.diff(rows, prepend=-1) != 0)
+        starts = numpy.flatnonzero(breaks)
+        ends = numpy.append(starts[1:], len(tiles)) - 1
+        bounds = self.surface.get_rect()
+        for row, first, last in zip(rows[starts], cols[starts], cols[ends]):
+            rect = pygame.Rect(int(first) * tile, int(row) * tile, int(last - first + 1) * tile, tile)
+            self.dirty_rects.append(rect.clip(bounds))
+
+    def pack(self, colors):
+        """
+        (n, 3) colors as the surface's native uint32 pixels, truncated to 8 bits a channel like image().
+        """
+        rgb = colors.astype(numpy.uint32)
+        r, g, b, _ = self.surface.get_shifts()
+        return (rgb[:, 0] << r) | (rgb[:, 1] << g) | (rgb[:, 2] << b)
 
     def graphics_initialize(self):
         logging.info("initialize %s %s", self.parameters.width, self.parameters.height)
         self.window_surface = pygame.display.set_mode((self.parameters.width, self.parameters.height))
-        self.surface = pygame.Surface((self.parameters.width, self.parameters.height))
+        # 32 bits deep so graphics_draw_points can write whole pixels through pixels2d
+        self.surface = pygame.Surface((self.parameters.width, self.parameters.height), 0, 32)
+
+
+def save(substrate, substrate_parameters, compress_level=6):
+    saveWorker.save(substrate, substrate_parameters, compress_level)
 
-    def update(self):
-        super().update()
-        self.window_surface.blit(self.surface, (0, 0))
-        if self.show_form:
-            self.manager.draw_ui(self.form_surface)
-            self.window_surface.blit(self.form_surface, (0, 0))
 
+class SimulationWorker(threading.Thread):
+    """
+    Runs a HeadlessSubstrate on its own thread, cycles_per_batch cycles at a time, and publishes
+    each batch's result to the display loop through a pair of frame buffers.
 
-def save(substrate, substrate_parameters):
-    buffer = pygame.image.tobytes(substrate.surface, 'RGB')
-    pil_image = PIL.Image.frombytes('RGB',
-                                    (substrate_parameters.width, substrate_parameters.height),
-                                    buffer
-                                    )
-    pnginfo = PIL.PngImagePlugin.PngInfo()
+    The display loop controls it with send(): 'pause' toggles pausing, 'quiesce' quiesces,
+    'step' runs one cycle, 'save' saves and 'stop' ends the thread.
+    """
 
-    parameters_json = jsons.dumps(substrate_parameters, verbose=True)
-    pnginfo.add_text("substrate_parameters", parameters_json)
+    def __init__(self, substrate_parameters, cycles_per_batch=10):
+        super().__init__(name='SimulationWorker', daemon=True)
+        self.substrate = HeadlessSubstrate(parameters=substrate_parameters)
+        self.substrate_parameters = substrate_parameters
+        self.cycles_per_batch = cycles_per_batch
+        self.commands = queue.Queue()
+        self.paused = False
+        self.was_done = False
+        shape = (substrate_parameters.height, substrate_parameters.width, 3)
+        self.front = numpy.zeros(shape, dtype=numpy.uint8)
+        self.back = numpy.zeros(shape, dtype=numpy.uint8)
+        self.frame_lock = threading.Lock()
+        self.new_frame = False
 
-    status = {
-        "cycles": substrate.cycles,
-        "next_crack_id_when_quiesced": substrate.next_crack_id_when_quiesced
-    }
-    status_json = jsons.dumps(status)
-    pnginfo.add_text("substrate_status", status_json)
+    def send(self, command):
+        self.commands.put(command)
 
-    pil_image.save('z.png', pnginfo=pnginfo)
-    timestamp = datetime.now().strftime("%Y%m%d%Y-%H%M%S")
-    pil_image.save(f'{timestamp}.png', pnginfo=pnginfo)
+    def run(self):
+        substrate = self.substrate
+        while True:
+            # block for commands when there is nothing to simulate
+            idle = self.paused or substrate.done
+            try:
+                command = self.commands.get(block=idle)
+            except queue.Empty:
+                command = None
+            steps = 0 if idle else self.cycles_per_batch
+            if command == 'stop':
+                return
+            elif command == 'pause':
+                self.paused = not self.paused
+                continue
+            elif command == 'quiesce':
+                substrate.quiesced = True
+            elif command == 'save':
+                save(substrate, self.substrate_parameters)
+            elif command == 'step':
+                steps = max(steps, 1)
 
-    with open(f'{timestamp}.json', 'w') as f:
-        f.write(jsons.dumps({"parameters": substrate_parameters, "status": status}, verbose=True))
+            for _ in range(steps):
+                if substrate.done:
+                    break
+                substrate.update()
+            if steps:
+                logging.debug("-- cycles=%d cracks=%d", substrate.cycles, substrate.crack_count())
+                self.publish()
+            if not self.was_done and substrate.done:
+                save(substrate, self.substrate_parameters)
+                self.was_done = True
+
+    def publish(self):
+        numpy.copyto(self.back, self.substrate.off_img.buf, casting='unsafe')
+        with self.frame_lock:
+            self.front, self.back = self.back, self.front
+            self.new_frame = True
 
 
 def transparent_surface(size, alpha, color=(0, 0, 0)):
@@ -135,10 +226,53 @@ def run(substrate_parameters=None):
         if step and not substrate.done:
             # substrate.done = True
             substrate.update()
-            logging.debug("-- cycles=%d cracks=%d %s", substrate.cycles, len(substrate.crack_list()),
-                          substrate.crack_list())
+            logging.debug("-- cycles=%d cracks=%d", substrate.cycles, substrate.crack_count())
         if not was_done and substrate.done:
             save(substrate, substrate_parameters)
             was_done = True
         substrate.manager.update(time_delta)
 
+
+
+def run_threaded(substrate_parameters=None, cycles_per_batch=10):
+    """
+    Like run(), but the simulation runs on a SimulationWorker as fast as it can, and this loop only
+    handles events and shows the latest published frame.
+    """
+    worker = SimulationWorker(substrate_parameters, cycles_per_batch)
+
+    pygame.init()
+    window_surface = pygame.display.set_mode((substrate_parameters.width, substrate_parameters.height))
+    worker.start()
+
+    need_to_exit = False
+    clock = pygame.time.Clock()
+
+    while not need_to_exit:
+        clock.tick(60)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                need_to_exit = True
+            elif event.type == pygame.KEYDOWN:
+                key = event.dict.get('key', None)
+                if key == 27:
+                    need_to_exit = True
+            elif event.type == pygame.TEXTINPUT:
+                logging.debug("event %s", event)
+                keystroke = event.dict.get('text', '').lower()
+                if keystroke == 'p':
+                    worker.send('pause')
+                elif keystroke == 'q':
+                    worker.send('quiesce')
+                elif keystroke == 's':
+                    worker.send('save')
+                elif keystroke == ' ':
+                    worker.send('step')
+        with worker.frame_lock:
+            if worker.new_frame:
+                pygame.surfarray.blit_array(window_surface, worker.front.transpose(1, 0, 2))
+                worker.new_frame = False
+                pygame.display.update()
+
+    worker.send('stop')
+    worker.join()
@@ -1,50 +1,68 @@
 import logging
 
-from datetime import datetime
 from typing import Optional
 
-import PIL.Image
-import PIL.PngImagePlugin
+import numpy
 import pyglet
 
 from Substrate import Substrate, SubstrateParameters
-
-import jsons
+import saveWorker
 
 
 class PygletSubstrate(Substrate):
+    """
+    Draws off_img through one canvas-sized texture.
+
+    graphics_draw_points only records which rows changed, in bands of BAND_ROWS rows, and
+    graphics_batch_end uploads the changed sub-rectangle of each dirty band from off_img. The window
+    draws the texture as a single quad, so the cost of a frame does not grow with the run.
+    """
+    BAND_ROWS = 32
+
     window: Optional[pyglet.window.Window]
+    texture: Optional[pyglet.image.Texture]
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.window = None
-        self.batch = None
+        self.texture = None
+        n_bands = (self.parameters.height + self.BAND_ROWS - 1) // self.BAND_ROWS
+        self.dirty_x0 = numpy.full(n_bands, self.parameters.width)
+        self.dirty_x1 = numpy.full(n_bands, -1)
         logging.info("__init__ %s", self)
 
     def graphics_batch_start(self):
-        self.logger.debug("batch start")
-        if self.batch is None:
-            self.batch = pyglet.graphics.Batch()
+        pass
 
     def graphics_batch_end(self):
-        self.logger.debug("batch end")
-        if self.batch is not None:
-            self.batch.draw()
-        # self.batch = None
-        # pyglet.app.exit()
+        dirty = numpy.flatnonzero(self.dirty_x1 >= 0)
+        for band in dirty:
+            x0 = int(self.dirty_x0[band])
+            x1 = int(self.dirty_x1[band]) + 1
+            y0 = band * self.BAND_ROWS
+            y1 = min(y0 + self.BAND_ROWS, self.parameters.height)
+            rows = self.frame(slice(y0, y1), slice(x0, x1))
+            self.texture.blit_into(pyglet.image.ImageData(x1 - x0, y1 - y0, 'RGB', rows.tobytes()), x0, y0, 0)
+        self.dirty_x0[dirty] = self.parameters.width
+        self.dirty_x1[dirty] = -1
 
     def graphics_draw_fill(self, color):
         logging.info("draw_fill %s", color)
-        rect = pyglet.shapes.Rectangle(x=0, y=0,
-                                       width=self.parameters.width, height=self.parameters.height, color=color,
-                                       batch=self.batch)
+        self.dirty_x0[:] = 0
+        self.dirty_x1[:] = self.parameters.width - 1
+
+    def graphics_draw_image(self):
+        self.dirty_x0[:] = 0
+        self.dirty_x1[:] = self.parameters.width - 1
 
     def graphics_draw_point(self, x, y, color):
-        logging.info("draw_point %d,%d %s", x, y, color)
-        c2 = tuple(int(c) for c in color)
-        rect = pyglet.shapes.Rectangle(x=int(x), y=int(y),
-                                       width=1, height=1, color=c2,
-                                       batch=self.batch)
+        self.graphics_draw_points(numpy.array([x]), numpy.array([y]), None)
+
+    def graphics_draw_points(self, xs, ys, colors):
+        # off_img already holds the colors, just remember where they went
+        bands = ys // self.BAND_ROWS
+        numpy.minimum.at(self.dirty_x0, bands, xs)
+        numpy.maximum.at(self.dirty_x1, bands, xs)
 
     def graphics_initialize(self):
         logging.info("initialize %s %s", self.parameters.width, self.parameters.height)
@@ -52,6 +70,12 @@ class PygletSubstrate(Substrate):
         self.window.set_size(self.parameters.width, self.parameters.height)
         self.window.set_maximum_size(self.parameters.width, self.parameters.height)
         self.window.set_minimum_size(self.parameters.width, self.parameters.height)
+        self.texture = pyglet.image.Texture.create(self.parameters.width, self.parameters.height)
+        self.window.push_handlers(on_draw=self.on_draw)
+
+    def on_draw(self):
+        self.window.clear()
+        self.texture.blit(0, 0)
 
 
 class PygletSubstrateApp:
@@ -60,39 +84,15 @@ class PygletSubstrateApp:
 
     def pyglet_clock_fired(self, delta_time):
         self.substrate.update()
-        logging.debug("-- cycles=%d cracks=%d %s", self.substrate.cycles, len(self.substrate.crack_list()),
-                      self.substrate.crack_list())
+        logging.debug("-- cycles=%d cracks=%d", self.substrate.cycles, self.substrate.crack_count())
 
     def pyglet_run(self):
-        pyglet.clock.schedule_interval(self.pyglet_clock_fired, 2.0)
+        pyglet.clock.schedule_interval(self.pyglet_clock_fired, 1 / 60.0)
         pyglet.app.run()
-        
-
-
-def save(substrate: PygletSubstrate, substrate_parameters):
-    # buffer = pygame.image.tobytes(substrate.surface, 'RGB')
-    pil_image = PIL.Image.frombytes('RGB',
-                                    (substrate_parameters.width, substrate_parameters.height),
-                                    buffer
-                                    )
-    pnginfo = PIL.PngImagePlugin.PngInfo()
-
-    parameters_json = jsons.dumps(substrate_parameters, verbose=True)
-    pnginfo.add_text("substrate_parameters", parameters_json)
-
-    status = {
-        "cycles": substrate.cycles,
-        "next_crack_id_when_quiesced": substrate.next_crack_id_when_quiesced
-    }
-    status_json = jsons.dumps(status)
-    pnginfo.add_text("substrate_status", status_json)
 
-    pil_image.save('z.png', pnginfo=pnginfo)
-    timestamp = datetime.now().strftime("%Y%m%d%Y-%H%M%S")
-    pil_image.save(f'{timestamp}.png', pnginfo=pnginfo)
 
-    with open(f'{timestamp}.json', 'w') as f:
-        f.write(jsons.dumps({"parameters": substrate_parameters, "status": status}, verbose=True))
+def save(substrate: PygletSubstrate, substrate_parameters, compress_level=6):
+    saveWorker.save(substrate, substrate_parameters, compress_level)
 
 
 
@@ -130,8 +130,7 @@ def runx(substrate_parameters=None):
         if step and not substrate.done:
             # substrate.done = True
             substrate.update()
-            logging.debug("-- cycles=%d cracks=%d %s", substrate.cycles, len(substrate.crack_list()),
-                          substrate.crack_list())
+            logging.debug("-- cycles=%d cracks=%d", substrate.cycles, substrate.crack_count())
         if not was_done and substrate.done:
             save(substrate, substrate_parameters)
             was_done = True
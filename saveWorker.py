@@ -0,0 +1,107 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import shutil
+import threading
+from datetime import datetime
+
+import PIL.Image
+import PIL.PngImagePlugin
+
+import jsons
+
+
+class SaveWorker(threading.Thread):
+    """
+    Encodes and writes saved frames on a background thread, so saving never stalls the simulation or UI loop.
+
+    Each save writes <timestamp>.png and <timestamp>.json, then points z.png at the same PNG with a
+    hard link (or a copy where links are not supported) instead of encoding it a second time.
+    Files appear under their final names only once complete. Saves still queued when the
+    interpreter exits are written before it does.
+    """
+
+    def __init__(self, directory='.', compress_level=6):
+        super().__init__(name='SaveWorker', daemon=True)
+        self.directory = directory
+        self.compress_level = compress_level
+        self.requests = queue.Queue()
+        self.logger = logging.getLogger('SaveWorker')
+        self.start()
+        atexit.register(self.close)
+
+    def submit(self, substrate, substrate_parameters, compress_level=None):
+        """
+        Queue a save of substrate as it is now. Only the frame conversion happens on the caller's thread.
+        """
+        if compress_level is None:
+            compress_level = self.compress_level
+        # image() is a fresh uint8 copy, so the simulation can carry on drawing into off_img
+        self.requests.put((substrate.image(), copy.copy(substrate_parameters), substrate.status(),
+                           datetime.now(), compress_level))
+
+    def flush(self):
+        """
+        Wait until every queued save has been written.
+        """
+        self.requests.join()
+
+    def close(self):
+        if self.is_alive():
+            self.requests.put(None)
+            self.join()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            try:
+                if request is None:
+                    return
+                self.write(*request)
+            except Exception:
+                self.logger.exception("save failed")
+            finally:
+                self.requests.task_done()
+
+    def write(self, image, substrate_parameters, status, when, compress_level):
+        pnginfo = PIL.PngImagePlugin.PngInfo()
+        pnginfo.add_text("substrate_parameters", jsons.dumps(substrate_parameters, verbose=True))
+        pnginfo.add_text("substrate_status", jsons.dumps(status))
+
+        timestamp = when.strftime("%Y%m%d%Y-%H%M%S")
+        png_path = os.path.join(self.directory, f'{timestamp}.png')
+        PIL.Image.fromarray(image, 'RGB').save(png_path + '.tmp', format='PNG', pnginfo=pnginfo,
+                                               compress_level=compress_level)
+        os.replace(png_path + '.tmp', png_path)
+
+        json_path = os.path.join(self.directory, f'{timestamp}.json')
+        with open(json_path + '.tmp', 'w') as f:
+            f.write(jsons.dumps({"parameters": substrate_parameters, "status": status}, verbose=True))
+        os.replace(json_path + '.tmp', json_path)
+
+        latest = os.path.join(self.directory, 'z.png')
+        try:
+            if os.path.exists(latest + '.tmp'):
+                os.remove(latest + '.tmp')
+            os.link(png_path, latest + '.tmp')
+        except OSError:
+            shutil.copyfile(png_path, latest + '.tmp')
+        os.replace(latest + '.tmp', latest)
+        self.logger.info("saved %s", png_path)
+
+
+_default_worker = None
+_default_worker_lock = threading.Lock()
+
+
+def save(substrate, substrate_parameters, compress_level=6):
+    """
+    Save substrate in the background to the current directory, through a SaveWorker shared by the whole process.
+    """
+    global _default_worker
+    with _default_worker_lock:
+        if _default_worker is None:
+            _default_worker = SaveWorker()
+    _default_worker.submit(substrate, substrate_parameters, compress_level)
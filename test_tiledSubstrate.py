@@ -0,0 +1,57 @@
+import numpy
+
+from Substrate import Array2D, SubstrateParameters
+from tiledSubstrate import TiledSubstrate, TileLayout, _tile_substrate
+
+
+def parameters(**kwargs):
+    return SubstrateParameters.seeded(7, width=256, height=256, max_num=80, initial_cracks=8, max_cycles=100,
+                                      engine='vector', **kwargs)
+
+
+def render(workers):
+    with TiledSubstrate(parameters(), tile_size=64, halo=16, workers=workers) as substrate:
+        substrate.run_until_done()
+        return substrate.image()
+
+
+def test_image_does_not_depend_on_workers():
+    serial = render(1).tobytes()
+    assert render(4).tobytes() == serial
+    assert render(4).tobytes() == serial
+
+
+def step(substrate, cycles):
+    # as _tile_worker does, minus handing the strays to their next tile
+    for cycle in range(cycles):
+        substrate.cycles = cycle
+        substrate.engine.step()
+        substrate.engine.take_strays()
+
+
+def test_tile_seeds_stay_in_window():
+    p = parameters()
+    layout = TileLayout(p.width, p.height, 64, 16)
+    c_grid = Array2D(p.width, p.height, 10001, numpy.float32)
+    off_img = Array2D(p.width, p.height, p.bg_color, numpy.float32)
+
+    # another tile has already drawn on the shared grid when this one is built
+    other = _tile_substrate(p, layout, 0, 1, c_grid, off_img)
+    other.engine.make_cracks(8)
+    step(other, 40)
+    assert (c_grid.buf <= 10000).any()
+
+    tile = 10
+    x0, y0, x1, y1 = layout.window(tile)
+    substrate = _tile_substrate(p, layout, tile, 1, c_grid, off_img)
+    assert len(substrate.crack_cells) == 0
+    substrate.engine.make_cracks(4)
+    step(substrate, 40)
+
+    cells = substrate.crack_cells
+    assert len(cells)
+    assert ((x0 <= cells.xs[:len(cells)]) & (cells.xs[:len(cells)] < x1)).all()
+    assert ((y0 <= cells.ys[:len(cells)]) & (cells.ys[:len(cells)] < y1)).all()
+
+    px, py, _, _ = substrate.engine._seed_points(500)
+    assert ((x0 <= px) & (px < x1) & (y0 <= py) & (py < y1)).all()
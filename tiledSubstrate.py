@@ -0,0 +1,288 @@
+import logging
+import math
+import multiprocessing
+import multiprocessing.shared_memory
+import random
+
+import numpy
+
+from Substrate import Array2D, SubstrateParameters
+from headlessSubstrate import HeadlessSubstrate
+from vectorEngine import VectorEngine
+
+
+class TileEngine(VectorEngine):
+    """
+    VectorEngine for one tile: it owns the cracks positioned inside the tile, keeps sand painter
+    strokes inside the tile plus its halo, and hands cracks that walk out of the tile to the tile
+    they walked into.
+    """
+
+    def __init__(self, substrate, layout, tile, seed):
+        super().__init__(substrate)
+        self.layout = layout
+        self.tile = tile
+        self.rng = numpy.random.default_rng([seed, tile])
+        self.region = layout.core(tile)
+        self.clip = layout.window(tile)
+        x0, y0, x1, y1 = self.region
+        p = self.parameters
+        self.max_num = math.ceil(p.max_num * (x1 - x0) * (y1 - y0) / (p.width * p.height))
+
+    def take_strays(self):
+        """
+        Remove the cracks now positioned outside this tile, returning {destination tile: rows}.
+        """
+        n = self.n
+        owner = self.layout.owner(self.x[:n], self.y[:n])
+        strays = owner != self.tile
+        if not strays.any():
+            return {}
+        handoffs = {}
+        for tile in numpy.unique(owner[strays]):
+            moving = owner == tile
+            handoffs[int(tile)] = {name: getattr(self, name)[:n][moving].copy() for name in self.fields()}
+        self._compact(~strays)
+        return handoffs
+
+    def receive(self, rows):
+        count = len(rows['x'])
+        if self.n + count > self.capacity:
+            self._grow(max(self.capacity * 2, self.n + count))
+        for name in self.fields():
+            getattr(self, name)[self.n:self.n + count] = rows[name]
+        self.n += count
+
+    @classmethod
+    def fields(cls):
+        return cls.FLOAT_FIELDS + cls.INT_FIELDS + ('curved',)
+
+
+class TileLayout:
+    """
+    Splits a width x height canvas into tile_size squares. Each tile's window is the tile grown by
+    halo pixels on every side, clipped to the canvas.
+
+    Tiles are stepped in four phases by the parity of their column and row, so tiles stepped
+    together are at least one tile apart. With 2 * halo <= tile_size their windows never overlap,
+    which is what lets them run at the same time without locking.
+    """
+
+    def __init__(self, width, height, tile_size, halo):
+        if 2 * halo > tile_size:
+            raise ValueError('halo must be at most half the tile size')
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.halo = halo
+        self.n_cols = (width + tile_size - 1) // tile_size
+        self.n_rows = (height + tile_size - 1) // tile_size
+
+    def __len__(self):
+        return self.n_cols * self.n_rows
+
+    def core(self, tile):
+        row, col = divmod(tile, self.n_cols)
+        return (col * self.tile_size, row * self.tile_size,
+                min((col + 1) * self.tile_size, self.width), min((row + 1) * self.tile_size, self.height))
+
+    def window(self, tile):
+        x0, y0, x1, y1 = self.core(tile)
+        return (max(x0 - self.halo, 0), max(y0 - self.halo, 0),
+                min(x1 + self.halo, self.width), min(y1 + self.halo, self.height))
+
+    def phase(self, tile):
+        row, col = divmod(tile, self.n_cols)
+        return (row % 2) * 2 + col % 2
+
+    def owner(self, x, y):
+        col = numpy.clip(numpy.floor(x).astype(numpy.intp) // self.tile_size, 0, self.n_cols - 1)
+        row = numpy.clip(numpy.floor(y).astype(numpy.intp) // self.tile_size, 0, self.n_rows - 1)
+        return row * self.n_cols + col
+
+
+def _shared_array(shm, shape, dtype):
+    return numpy.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _tile_substrate(parameters, layout, tile, seed, c_grid, off_img):
+    # other workers may already have drawn on the shared grids; this tile's crack_cells must only
+    # ever hold its own cracks, so the grid is not indexed (see Substrate's index_existing)
+    substrate = HeadlessSubstrate(parameters=parameters, c_grid=c_grid, off_img=off_img)
+    substrate.engine = TileEngine(substrate, layout, tile, seed)
+    # crack ids stay unique across tiles
+    substrate.next_crack_id = tile << 40
+    substrate.initialized = True
+    return substrate
+
+
+def _tile_worker(conn, parameters, layout, tiles, seed, c_grid_name, off_img_name):
+    """
+    Worker process: steps its tiles when told to, drawing straight into the shared canvas.
+    """
+    c_grid_shm = multiprocessing.shared_memory.SharedMemory(name=c_grid_name)
+    off_img_shm = multiprocessing.shared_memory.SharedMemory(name=off_img_name)
+    c_grid = Array2D(buf=_shared_array(c_grid_shm, (parameters.height, parameters.width), numpy.float32))
+    off_img = Array2D(buf=_shared_array(off_img_shm, (parameters.height, parameters.width, 3), numpy.float32))
+
+    substrates = {tile: _tile_substrate(parameters, layout, tile, seed, c_grid, off_img) for tile in tiles}
+
+    while True:
+        message = conn.recv()
+        if message[0] == 'stop':
+            break
+        elif message[0] == 'start':
+            for tile, count in message[1].items():
+                substrates[tile].engine.make_cracks(count)
+            conn.send({tile: s.engine.n for tile, s in substrates.items()})
+        elif message[0] == 'step':
+            _, cycle, phase, inboxes = message
+            handoffs = []
+            for tile, substrate in substrates.items():
+                if layout.phase(tile) != phase:
+                    continue
+                engine = substrate.engine
+                for rows in inboxes.get(tile, ()):
+                    engine.receive(rows)
+                substrate.cycles = cycle
+                engine.step()
+                for destination, rows in engine.take_strays().items():
+                    handoffs.append((destination, tile, rows))
+            conn.send((handoffs, {tile: s.engine.n for tile, s in substrates.items()}))
+
+    del c_grid, off_img
+    c_grid_shm.close()
+    off_img_shm.close()
+
+
+class TiledSubstrate:
+    """
+    Runs the vector engine over a canvas split into tiles, stepping the tiles on a pool of worker
+    processes that share c_grid and off_img through shared memory.
+
+    Each cycle runs in four phases (see TileLayout). Cracks that walk out of their tile are handed to
+    the tile they walked into at the next cycle boundary. Sand painter strokes are clipped to the
+    tile's window, spawns branch from cracks drawn by the same tile, and max_num is shared out
+    between tiles by area, so the image has the same statistics as a serial run rather than the
+    same pixels. seamless is not supported.
+
+    Determinism: for a fixed seed, tile_size and halo the image is bit-identical from run to run,
+    whatever the number of workers. Tiles stepped together never touch the same cells, every tile
+    draws from its own random stream, and handoffs are delivered in tile order.
+    """
+
+    def __init__(self, parameters: SubstrateParameters, tile_size=1024, halo=64, workers=None):
+        if parameters.seamless:
+            raise ValueError('tiled substrates cannot be seamless')
+        self.parameters = parameters
+        self.layout = TileLayout(parameters.width, parameters.height, tile_size, halo)
+        self.logger = logging.getLogger('TiledSubstrate')
+        self.cycles = 0
+        self.done = False
+        self.crack_counts = {}
+        self.inboxes = {}
+
+        if parameters.seed is None:
+            parameters.seed = random.getstate()
+        else:
+            random.setstate(parameters.seed)
+        seed = random.getrandbits(64)
+
+        shape = (parameters.height, parameters.width)
+        self.c_grid_shm = multiprocessing.shared_memory.SharedMemory(create=True, size=4 * shape[0] * shape[1])
+        self.off_img_shm = multiprocessing.shared_memory.SharedMemory(create=True, size=12 * shape[0] * shape[1])
+        self.c_grid = Array2D(buf=_shared_array(self.c_grid_shm, shape, numpy.float32))
+        self.off_img = Array2D(buf=_shared_array(self.off_img_shm, shape + (3,), numpy.float32))
+        self.c_grid.fill(10001)
+        self.off_img.fill(parameters.bg_color)
+
+        n_workers = min(workers or multiprocessing.cpu_count(), len(self.layout))
+        self.connections = []
+        self.processes = []
+        for w in range(n_workers):
+            parent, child = multiprocessing.Pipe()
+            tiles = list(range(w, len(self.layout), n_workers))
+            process = multiprocessing.Process(target=_tile_worker, daemon=True,
+                                              args=(child, parameters, self.layout, tiles, seed,
+                                                    self.c_grid_shm.name, self.off_img_shm.name))
+            process.start()
+            self.connections.append(parent)
+            self.processes.append(process)
+
+        # place the initial cracks uniformly over the canvas, each tile starts the ones that fall on it
+        rng = numpy.random.default_rng(seed)
+        owners = self.layout.owner(rng.uniform(0, parameters.width, parameters.initial_cracks),
+                                   rng.uniform(0, parameters.height, parameters.initial_cracks))
+        counts = numpy.bincount(owners, minlength=len(self.layout))
+        for w, conn in enumerate(self.connections):
+            conn.send(('start', {tile: int(counts[tile]) for tile in range(w, len(self.layout), n_workers)}))
+        for conn in self.connections:
+            self.crack_counts.update(conn.recv())
+
+    def crack_count(self):
+        # cracks stepped by the workers, plus the ones waiting to be handed to their next tile
+        in_transit = sum(len(rows['x']) for inbox in self.inboxes.values() for rows in inbox)
+        return sum(self.crack_counts.values()) + in_transit
+
+    def update(self):
+        self.cycles += 1
+        handoffs = []
+        for phase in range(4):
+            for w, conn in enumerate(self.connections):
+                tiles = range(w, len(self.layout), len(self.connections))
+                conn.send(('step', self.cycles, phase,
+                           {tile: self.inboxes.pop(tile) for tile in tiles
+                            if self.layout.phase(tile) == phase and tile in self.inboxes}))
+            for conn in self.connections:
+                sent, counts = conn.recv()
+                handoffs.extend(sent)
+                self.crack_counts.update(counts)
+
+        # deliver in (destination, source) order so the result does not depend on the workers
+        for destination, source, rows in sorted(handoffs, key=lambda h: (h[0], h[1])):
+            self.inboxes.setdefault(destination, []).append(rows)
+
+        if self.parameters.max_cycles is not None and self.parameters.max_cycles > 0:
+            if self.cycles > self.parameters.max_cycles:
+                self.done = True
+        if self.crack_count() == 0:
+            self.done = True
+
+    def run_until_done(self):
+        while not self.done:
+            self.update()
+        return self
+
+    def image(self):
+        return self.off_img.buf.astype(numpy.uint8)
+
+    def close(self):
+        for conn in self.connections:
+            conn.send(('stop',))
+        for process in self.processes:
+            process.join()
+        del self.c_grid, self.off_img
+        self.c_grid_shm.close()
+        self.c_grid_shm.unlink()
+        self.off_img_shm.close()
+        self.off_img_shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    substrate_parameters = SubstrateParameters.seeded(1, height=2048, width=2048, max_num=400, initial_cracks=16,
+                                                      max_cycles=500, engine='vector')
+    with TiledSubstrate(substrate_parameters, tile_size=512) as substrate:
+        substrate.run_until_done()
+        logging.info("%d cycles, %d cracks", substrate.cycles, substrate.crack_count())
+
+
+if __name__ == '__main__':
+    main()
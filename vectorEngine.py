@@ -0,0 +1,306 @@
+import random
+import time
+
+import numpy
+
+from Substrate import START_CRACK_TRIES, STEP
+
+
+class VectorEngine:
+    """
+    Struct-of-arrays crack engine, selected with SubstrateParameters.engine = 'vector'.
+
+    Crack state lives in parallel numpy arrays (the first n entries are live) and every live crack
+    is advanced, sand painted and collision tested in one vectorized step per cycle. Deaths are
+    compacted out of the table and their replacements spawned afterwards.
+
+    The engine draws from its own numpy Generator, seeded from `random` after the substrate
+    has applied SubstrateParameters.seed, so a run is reproducible for a fixed seed but is not
+    the same image the reference engine draws for that seed.
+    """
+
+    FLOAT_FIELDS = ('x', 'y', 't', 'xs', 'ys', 't_inc', 'degrees_drawn', 'sand_g', 'sand_p',
+                    'x_start', 'y_start', 'cos_t', 'sin_t', 'cos_inc', 'sin_inc')
+    INT_FIELDS = ('color', 'crack_id', 'cycle_start')
+    MARCH_CHUNK = 32
+    MAX_MARCH_CHUNK = 4096
+
+    def __init__(self, substrate, capacity=64):
+        self.substrate = substrate
+        self.parameters = substrate.parameters
+        self.rng = numpy.random.default_rng(random.getrandbits(64))
+        # New cracks start inside region and sand painter strokes stay inside clip, both (x0, y0, x1, y1).
+        # They cover the whole canvas unless a tiled run (see tiledSubstrate.py) narrows them.
+        self.region = self.clip = (0, 0, self.parameters.width, self.parameters.height)
+        self.max_num = self.parameters.max_num
+        self.n = 0
+        self.capacity = 0
+        self._grow(capacity)
+
+    def _grow(self, capacity):
+        for name in self.FLOAT_FIELDS:
+            self._resize(name, capacity, numpy.float64)
+        for name in self.INT_FIELDS:
+            self._resize(name, capacity, numpy.int64)
+        self._resize('curved', capacity, numpy.bool_)
+        self.capacity = capacity
+
+    def _resize(self, name, capacity, dtype):
+        new = numpy.zeros(capacity, dtype=dtype)
+        if self.capacity:
+            new[:self.n] = getattr(self, name)[:self.n]
+        setattr(self, name, new)
+
+    def _compact(self, keep):
+        n = int(keep.sum())
+        for name in self.FLOAT_FIELDS + self.INT_FIELDS + ('curved',):
+            a = getattr(self, name)
+            a[:n] = a[:self.n][keep]
+        self.n = n
+
+    def make_cracks(self, count):
+        p = self.parameters
+        s = self.substrate
+        if s.quiesced:
+            return
+        count = min(count, self.max_num - self.n)
+        if count <= 0:
+            return
+        profiler = s.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        if self.n + count > self.capacity:
+            self._grow(max(self.capacity * 2, self.n + count))
+
+        new = slice(self.n, self.n + count)
+        self.crack_id[new] = numpy.arange(s.next_crack_id, s.next_crack_id + count)
+        s.next_crack_id += count
+        self.sand_p[new] = 0
+        self.sand_g[new] = self.rng.uniform(-0.01, 0.19, count)
+        self.color[new] = self.rng.integers(0, len(s.palette), count)
+        self.degrees_drawn[new] = 0
+        self.cycle_start[new] = s.cycles
+
+        px, py, a, branched = self._seed_points(count)
+
+        a += numpy.where(self.rng.random(count) < 0.5, -90, 90) + self.rng.uniform(-2, 2.1, count)
+
+        curved = self.rng.integers(0, 101, count) < p.circle_percent
+        r = 10 + self.rng.uniform(0, (p.width + p.height) / 2.0, count)
+        r = numpy.where(self.rng.random(count) < 0.5, -r, r)
+        # arc length = r * theta => inc = theta = arc length / r
+        radian_inc = STEP / r
+        self.curved[new] = curved
+        self.t_inc[new] = numpy.where(curved, numpy.degrees(radian_inc), 0)
+        # straight cracks turn by 0, which leaves their cos_t and sin_t exactly as they are
+        self.cos_inc[new] = numpy.where(curved, numpy.cos(radian_inc), 1)
+        self.sin_inc[new] = numpy.where(curved, numpy.sin(radian_inc), 0)
+        self.ys[new] = numpy.where(curved, r * numpy.sin(radian_inc), 0)
+        self.xs[new] = numpy.where(curved, r * (1 - numpy.cos(radian_inc)), 0)
+
+        self.x[new] = self.x_start[new] = px + 0.61 * numpy.cos(numpy.radians(a))
+        self.y[new] = self.y_start[new] = py + 0.61 * numpy.sin(numpy.radians(a))
+        self.t[new] = a
+        self.cos_t[new] = numpy.cos(numpy.radians(a))
+        self.sin_t[new] = numpy.sin(numpy.radians(a))
+        self.n += count
+        if s.tracer is not None:
+            for i in range(new.start, new.stop):
+                s.tracer.spawn(s.cycles, int(self.crack_id[i]), float(self.x[i]), float(self.y[i]), float(self.t[i]),
+                               bool(branched[i - new.start]))
+        if profiler is not None:
+            profiler.add_time('start_crack', time.perf_counter() - start)
+            profiler.count('cracks_spawned', count)
+
+    def _seed_points(self, count):
+        """
+        Pick a point on an existing crack for each new crack, returning (px, py, angle at that point,
+        whether it was found on a crack rather than made up).
+        """
+        p = self.parameters
+        c_grid = self.substrate.c_grid.buf
+        cells = self.substrate.crack_cells
+        # see Substrate.start_crack for where the miss probability comes from
+        x0, y0, x1, y1 = self.region
+        miss = (1.0 - len(cells) / ((x1 - x0) * (y1 - y0))) ** START_CRACK_TRIES
+        if len(cells):
+            missed = self.rng.random(count) < miss
+            pick = self.rng.integers(0, len(cells), count)
+            px = cells.xs[pick].astype(numpy.intp)
+            py = cells.ys[pick].astype(numpy.intp)
+            a = c_grid[py, px].astype(numpy.float64)
+        else:
+            missed = numpy.ones(count, dtype=numpy.bool_)
+            px = numpy.zeros(count, dtype=numpy.intp)
+            py = numpy.zeros(count, dtype=numpy.intp)
+            a = numpy.zeros(count)
+
+        if self.substrate.profiler is not None:
+            self.substrate.profiler.count('start_crack_misses', int(missed.sum()))
+        for k in numpy.flatnonzero(missed):
+            # nothing to branch from, start a crack from scratch
+            px[k] = self.rng.integers(x0, x1)
+            py[k] = self.rng.integers(y0, y1)
+            a[k] = self.rng.uniform(0, 360)
+            if c_grid[py[k], px[k]] > 10000:
+                cells.add(px[k], py[k])
+            c_grid[py[k], px[k]] = int(a[k])
+        return px, py, a, ~missed
+
+    def step(self):
+        p = self.parameters
+        s = self.substrate
+        n = self.n
+        if n == 0:
+            return
+        x, y, t = self.x[:n], self.y[:n], self.t[:n]
+        curved = self.curved[:n]
+
+        cos_t = self.cos_t[:n]
+        sin_t = self.sin_t[:n]
+        # cos(t - 90) = sin(t), sin(t - 90) = -cos(t)
+        x += numpy.where(curved, self.ys[:n] * cos_t + self.xs[:n] * sin_t, STEP * cos_t)
+        y += numpy.where(curved, self.ys[:n] * sin_t - self.xs[:n] * cos_t, STEP * sin_t)
+        t[curved] += self.t_inc[:n][curved]
+        # advance the direction by rotating it by t_inc, as Substrate.move_draw_crack does
+        cos_inc = self.cos_inc[:n]
+        sin_inc = self.sin_inc[:n]
+        cos_t[:], sin_t[:] = cos_t * cos_inc - sin_t * sin_inc, sin_t * cos_inc + cos_t * sin_inc
+        self.degrees_drawn[:n][curved] += numpy.abs(self.t_inc[:n][curved])
+
+        cx = (x + self.rng.uniform(0.33, 0.66, n)).astype(numpy.intp)
+        cy = (y + self.rng.uniform(0.33, 0.66, n)).astype(numpy.intp)
+        if p.seamless:
+            cx = (cx + p.width) % p.width
+            cy = (cy + p.height) % p.height
+
+        inside = (0 <= cx) & (cx < p.width) & (0 <= cy) & (cy < p.height)
+        live = numpy.flatnonzero(inside)
+
+        if not p.wireframe and len(live):
+            self.region_color(live)
+
+        fg = p.fg_color
+        s.off_img.buf[cy[live], cx[live]] = fg
+        s.draw_points(cx[live], cy[live], numpy.asarray(fg, dtype=numpy.float64))
+
+        dead = ~inside
+        circled = curved & (self.degrees_drawn[:n] > 360)
+        dead |= inside & circled
+        collided = self._collide(live[~circled[live]], cx, cy)
+        dead[collided] = True
+
+        deaths = int(dead.sum())
+        if s.profiler is not None:
+            s.profiler.count('cracks_killed', deaths)
+        if s.tracer is not None and deaths:
+            self._trace_deaths(dead, inside & circled, collided)
+        if deaths:
+            self._compact(~dead)
+            self.make_cracks(2 * deaths)
+
+    def _trace_deaths(self, dead, circled, collided):
+        s = self.substrate
+        reasons = numpy.where(circled, 'circle', 'out of bounds').astype(object)
+        reasons[collided] = 'collision'
+        for i in numpy.flatnonzero(dead):
+            s.tracer.death(s.cycles, int(self.crack_id[i]), reasons[i], float(self.x_start[i]),
+                           float(self.y_start[i]), float(self.x[i]), float(self.y[i]), int(self.cycle_start[i]))
+
+    def _collide(self, idx, cx, cy):
+        """
+        Test cracks idx against c_grid and extend the ones that may continue, returning those that hit another crack.
+
+        Cracks that land on a cell also claimed by another crack this cycle are resolved one at a
+        time in table order, as the reference engine would.
+        """
+        c_grid = self.substrate.c_grid.buf
+        width = self.parameters.width
+        cells = cy[idx] * width + cx[idx]
+        _, first, counts = numpy.unique(cells, return_index=True, return_counts=True)
+        shared = numpy.isin(cells, cells[first[counts > 1]])
+
+        alone = idx[~shared]
+        g = c_grid[cy[alone], cx[alone]]
+        t = self.t[alone]
+        extend = (g > 10000) | (numpy.abs(g - t) < 5)
+        fresh = alone[extend & (g > 10000)]
+        self.substrate.crack_cells.add_many(cx[fresh], cy[fresh])
+        c_grid[cy[alone[extend]], cx[alone[extend]]] = t[extend].astype(numpy.int32)
+        hit = list(alone[~extend & (numpy.abs(g) > 2)])
+
+        for i in idx[shared]:
+            g = c_grid[cy[i], cx[i]]
+            if g > 10000 or abs(g - self.t[i]) < 5:
+                if g > 10000:
+                    self.substrate.crack_cells.add(cx[i], cy[i])
+                c_grid[cy[i], cx[i]] = int(self.t[i])
+            elif abs(g) > 2:
+                hit.append(i)
+        return numpy.asarray(hit, dtype=numpy.intp)
+
+    def region_color(self, idx):
+        p = self.parameters
+        s = self.substrate
+        if s.profiler is not None:
+            start = time.perf_counter()
+        c_grid = s.c_grid.buf
+        clip_x0, clip_y0, clip_x1, clip_y1 = self.clip
+        x0 = self.x[idx]
+        y0 = self.y[idx]
+        dx = 0.81 * self.sin_t[idx]
+        dy = -0.81 * self.cos_t[idx]
+
+        # march every crack's ray at once until each one leaves open space, testing a chunk of
+        # steps per pass and doubling the chunk for rays that keep going
+        rx = x0.copy()
+        ry = y0.copy()
+        chunk = self.MARCH_CHUNK
+        marching = numpy.arange(len(idx))
+        while len(marching):
+            steps = numpy.arange(1, chunk + 1)
+            px = rx[marching, numpy.newaxis] + dx[marching, numpy.newaxis] * steps
+            py = ry[marching, numpy.newaxis] + dy[marching, numpy.newaxis] * steps
+            cx = px.astype(numpy.intp)
+            cy = py.astype(numpy.intp)
+            if p.seamless:
+                cx %= p.width
+                cy %= p.height
+            open_space = (clip_x0 <= cx) & (cx < clip_x1) & (clip_y0 <= cy) & (cy < clip_y1)
+            open_space[open_space] = c_grid[cy[open_space], cx[open_space]] > 10000
+            stopped = ~open_space.all(axis=1)
+            last = numpy.where(stopped, numpy.argmin(open_space, axis=1), chunk - 1)
+            rows = numpy.arange(len(marching))
+            rx[marching] = px[rows, last]
+            ry[marching] = py[rows, last]
+            marching = marching[~stopped]
+            chunk = min(chunk * 2, self.MAX_MARCH_CHUNK)
+
+        sand_g = self.sand_g[idx] + self.rng.uniform(-0.050, 0.050, len(idx))
+        sand_g = numpy.clip(sand_g, 0, 1.0)
+        self.sand_g[idx] = sand_g
+
+        grains = p.grains
+        i = numpy.arange(grains)
+        w = sand_g / (grains - 1)
+        sines = numpy.sin(self.sand_p[idx, numpy.newaxis] + numpy.sin(i * w[:, numpy.newaxis]))
+        draw_x = x0[:, numpy.newaxis] + (rx - x0)[:, numpy.newaxis] * sines
+        draw_y = y0[:, numpy.newaxis] + (ry - y0)[:, numpy.newaxis] * sines
+        if p.seamless:
+            draw_x = (draw_x + p.width) % p.width
+            draw_y = (draw_y + p.height) % p.height
+
+        colors = s.palette[self.color[idx]]
+        draw_x = draw_x.ravel()
+        draw_y = draw_y.ravel()
+        colors = numpy.repeat(colors, grains, axis=0)
+        alphas = numpy.tile(0.1 - i / (grains * 10), len(idx))
+        if self.clip != (0, 0, p.width, p.height):
+            ix = draw_x.astype(numpy.intp)
+            iy = draw_y.astype(numpy.intp)
+            keep = (clip_x0 <= ix) & (ix < clip_x1) & (clip_y0 <= iy) & (iy < clip_y1)
+            draw_x, draw_y, colors, alphas = draw_x[keep], draw_y[keep], colors[keep], alphas[keep]
+        xs, ys, blended = s.trans_points(draw_x, draw_y, colors, alphas)
+        s.draw_points(xs, ys, blended)
+        if s.profiler is not None:
+            s.profiler.add_time('region_color', time.perf_counter() - start)